@@ -5,10 +5,12 @@ from src.roboflow import download_dataset
 from src.remap import remap_labels
 from src.invert import invert_yolo_data
 from src.merger import merge_yolo_datasets
+from src.dedup import dedup_yolo_dataset, write_dedup_data_yaml
 from src.ai import train_model, test_model
 from src.data_wrangler import YOLODataset
 import albumentations as A
-from snapstitch import Stitcher, PartsLoader, BackgroundLoader, YOLOv8Generator
+from snapstitch import Stitcher, PartsLoader, BackgroundLoader
+from src.generator import YOLOv8Generator
 from ultralytics import YOLO
 from src.utils import copy_random_half_files
 
@@ -67,18 +69,17 @@ os.rename(f"{coco_dir}/coco/labels/val2017", f"{coco_dir}/labels/val")
 remap_labels(f"{coco_dir}/labels/train", {0: [5]})
 remap_labels(f"{coco_dir}/labels/val", {0: [5]})
 
-# Backup coco dataset before changes
-shutil.copytree(coco_dir, f"{coco_dir}_backup") 
-
-coco_dataset = YOLODataset(coco_dir, ["bus"], ["train", "val"])
-coco_dataset.remove_classes_inplace([0])
+# Black out buses into a separate tree, untouched images are hardlinked so the
+# original coco dataset stays intact for merging later
+coco_dataset = YOLODataset(coco_dir, ["bus"], ["train", "val"], cache=True, classes_of_interest=[0])
+coco_no_bus_dir = coco_dataset.remove_classes([0], f"{coco_dir}_no_bus", workers=os.cpu_count())
 
 # Move images to backgrounds folder
 os.makedirs(f"{stitch_backgrounds}/coco/train", exist_ok=True)
 os.makedirs(f"{stitch_backgrounds}/coco/val", exist_ok=True)
 
-os.rename(f"{coco_dir}/images/train", f"{stitch_backgrounds}/coco/train")
-os.rename(f"{coco_dir}/images/val", f"{stitch_backgrounds}/coco/val")
+os.rename(f"{coco_no_bus_dir}/images/train", f"{stitch_backgrounds}/coco/train")
+os.rename(f"{coco_no_bus_dir}/images/val", f"{stitch_backgrounds}/coco/val")
 
 # Download the Singapore Bus Data
 
@@ -97,7 +98,7 @@ for path, labels, split in ROBOFLOW_PATHS_UNLABELED:
     remap_labels(f"{dataset_path}/labels/valid", labels)
     output_paths_labeled.append(dataset_path)
 
-    dataset = YOLODataset(dataset_path, ["bus"], ["train", "val"]) 
+    dataset = YOLODataset(dataset_path, ["bus"], ["train", "val"], cache=True, classes_of_interest=[0]) 
     dataset.crop_images(stitch_crops + "/" + split + "/" + path.split("/")[-1], [0])
 
 
@@ -119,7 +120,7 @@ for path, split in ROBOFLOW_PATHS_UNLABELED:
     invert_yolo_data(dataset_dir)
     
     # Extract crops of buses
-    dataset = YOLODataset(dataset_dir, ["bus"], ["train", "val"]) 
+    dataset = YOLODataset(dataset_dir, ["bus"], ["train", "val"], cache=True) 
     dataset.crop_using_model(pretrained_model, split, stitch_crops + "/" + split + "/" + path.split("/")[-1], "bus")
 
 
@@ -142,7 +143,8 @@ val_background = BackgroundLoader(f"{stitch_backgrounds}/coco/val", target_size=
 bus_part_train = PartsLoader(stitch_crops + "/train", scale=1.4, transform=transform, scaling_variation=0.2, max_cache_size=1000)
 bus_part_val = PartsLoader(stitch_crops + "/val", scale=1.4, transform=transform, scaling_variation=0.2, max_cache_size=1000)
 
-generator = YOLOv8Generator(overlap_ratio=0.05)
+# JPEG encoding and writes run on background threads while the next image is composed
+generator = YOLOv8Generator(overlap_ratio=0.05, writers=os.cpu_count())
 
 train_stitcher = Stitcher(generator, train_background, {
     "0": [bus_part_train, 0.1],
@@ -173,17 +175,34 @@ val_stitcher.execute(
     perimeter_end=(1280, 720)
 )
 
-# Merge backup coco dataset into data folder
+# Wait for the queued samples before the stitched data is used
+generator.close()
+
+# Profile every source before it is merged into the training data
+
+for source in [coco_dir, *output_paths_labeled]:
+    source_dataset = YOLODataset(source, ["bus"], ["train", "val", "valid"], cache=True)
+    source_dataset.stats(json_path=f"stats/{os.path.basename(source)}.json")
+
+# Merge original coco dataset into data folder
 
 merge_yolo_datasets(
-    [f"{coco_dir}_backup", *output_paths_labeled, *output_paths_labeled, *output_paths_labeled],
+    [coco_dir, *output_paths_labeled, *output_paths_labeled, *output_paths_labeled],
     "data_train",
 )
 
+# Drop duplicate and near-duplicate frames across the merged sources. Every split
+# in the merged tree is included (sources add valid and test next to the stitched
+# train and val), train first so leaked copies are dropped from the other splits
+
+manifests = dedup_yolo_dataset("data_train", None, workers=os.cpu_count())
+write_dedup_data_yaml("data.yaml", manifests, "data_dedup.yaml")
+
 # Train the model
 
 train_model(
     "yolo11m.pt",
     "default.yaml",
-    "data.yaml",
+    "data_dedup.yaml",
+    resize=True,
 )
\ No newline at end of file
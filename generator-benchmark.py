@@ -0,0 +1,96 @@
+import time
+import cv2
+import numpy as np
+from src.generator import YOLOv8Generator
+
+"""
+
+Micro benchmark of YOLOv8Generator._place_part
+
+Composites the same parts onto 720p backgrounds with the old float64 blend and
+with the current fixed-point kernel, and prints images/sec for opaque (BGR) and
+transparent (BGRA) parts.
+
+"""
+
+NUM_IMAGES = 200
+PARTS_PER_IMAGE = 3
+BACKGROUND_SIZE = (720, 1280)
+PART_SIZE = (300, 400)
+
+
+def legacy_place_part(background, part, position):
+    # _place_part before the fixed-point kernel
+    background = background[:, :, :3]
+    part_width, part_height = part.shape[1], part.shape[0]
+    background_width, background_height = background.shape[1], background.shape[0]
+
+    if part.shape[2] == 4:
+        part_alpha = part[:, :, 3] / 255.0
+        part = part[:, :, :3]
+    else:
+        part_alpha = np.ones((part_height, part_width))
+    x1, y1 = position[0]
+    x2, y2 = position[1]
+
+    x1_clamped = max(x1, 0)
+    x2_clamped = min(x2, background_width)
+    y1_clamped = max(y1, 0)
+    y2_clamped = min(y2, background_height)
+
+    bg_slice = background[y1_clamped:y2_clamped, x1_clamped:x2_clamped, :]
+    part_slice = part[: y2_clamped - y1_clamped, : x2_clamped - x1_clamped, :]
+    alpha_slice = part_alpha[: y2_clamped - y1_clamped, : x2_clamped - x1_clamped]
+
+    background[y1_clamped:y2_clamped, x1_clamped:x2_clamped] = (
+        1 - alpha_slice[:, :, np.newaxis]
+    ) * bg_slice + alpha_slice[:, :, np.newaxis] * part_slice
+    return background
+
+
+def run(place_part, backgrounds, parts, positions):
+    outputs = []
+    start = time.perf_counter()
+    for background, image_positions in zip(backgrounds, positions):
+        image = background.copy()
+        for part, position in zip(parts, image_positions):
+            image = place_part(image, part, position)
+        outputs.append(image)
+    return len(backgrounds) / (time.perf_counter() - start), outputs
+
+
+rng = np.random.default_rng(0)
+generator = YOLOv8Generator()
+backgrounds = [rng.integers(0, 256, (*BACKGROUND_SIZE, 3), dtype=np.uint8) for _ in range(8)] * (NUM_IMAGES // 8)
+
+# Random positions fully inside the background
+positions = []
+for _ in backgrounds:
+    image_positions = []
+    for _ in range(PARTS_PER_IMAGE):
+        x = int(rng.integers(0, BACKGROUND_SIZE[1] - PART_SIZE[1]))
+        y = int(rng.integers(0, BACKGROUND_SIZE[0] - PART_SIZE[0]))
+        image_positions.append(((x, y), (x + PART_SIZE[1], y + PART_SIZE[0]), 0))
+    positions.append(image_positions)
+
+opaque_parts = [rng.integers(0, 256, (*PART_SIZE, 3), dtype=np.uint8) for _ in range(PARTS_PER_IMAGE)]
+cutout_parts, noisy_parts = [], []
+for part in opaque_parts:
+    # Feathered object mask like a real cut out object
+    alpha = np.zeros(PART_SIZE, dtype=np.uint8)
+    cv2.ellipse(alpha, (PART_SIZE[1] // 2, PART_SIZE[0] // 2), (PART_SIZE[1] // 2 - 20, PART_SIZE[0] // 2 - 20),
+                0, 0, 360, 255, -1)
+    cutout_parts.append(np.dstack([part, cv2.GaussianBlur(alpha, (7, 7), 0)]))
+
+    # Worst case, partial alpha over a wide border
+    alpha = rng.integers(0, 256, PART_SIZE, dtype=np.uint8)
+    alpha[40:-40, 40:-40] = 255
+    noisy_parts.append(np.dstack([part, alpha]))
+
+for name, parts in [("opaque BGR parts", opaque_parts), ("cut out BGRA parts", cutout_parts),
+                    ("noisy edge BGRA parts", noisy_parts)]:
+    legacy_rate, legacy_outputs = run(legacy_place_part, backgrounds, parts, positions)
+    rate, outputs = run(generator._place_part, backgrounds, parts, positions)
+    max_difference = max(int(np.abs(a.astype(int) - b.astype(int)).max()) for a, b in zip(legacy_outputs, outputs))
+    print(f"{name}: legacy {legacy_rate:.1f} images/sec, fixed-point {rate:.1f} images/sec "
+          f"({rate / legacy_rate:.1f}x), max pixel difference {max_difference}")
@@ -35,7 +35,7 @@ for path, labels, split in ROBOFLOW_PATHS_UNLABELED:
     remap_labels(f"{dataset_path}/labels/train", labels)
     remap_labels(f"{dataset_path}/labels/valid", labels)
 
-    dataset = YOLODataset(dataset_path, ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12", "13", "14", "15"], ["train", "valid"]) 
+    dataset = YOLODataset(dataset_path, ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12", "13", "14", "15"], ["train", "valid"], cache=True) 
     dataset.crop_images(stitching_crops, [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15])
 
     if path == "https://universe.roboflow.com/ram-khlww/bus-emts1-chcch":
@@ -51,11 +51,11 @@ invert_yolo_data(number_dataset)
 remap_labels(f"{number_dataset}/labels/train", number_dataset_labels)
 remap_labels(f"{number_dataset}/labels/valid", number_dataset_labels)
 
-number_dataset = YOLODataset(number_dataset, ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12", "13", "14", "15"], ["train", "valid"]) 
+number_dataset = YOLODataset(number_dataset, ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12", "13", "14", "15"], ["train", "valid"], cache=True) 
 number_dataset.crop_images(stitching_crops, [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15])
 
 
-stitch_crops_dataset = StitchingCrops(stitching_crops + "/train")
+stitch_crops_dataset = StitchingCrops(stitching_crops + "/train", atlas=stitching_crops + "/train.atlas")
 
 ROBOFLOW_PATHS_UNLABELED = [
     ["https://universe.roboflow.com/nanyang-polytechnic-rskkz/nanyang-poly---block-502-bus-stops", 
@@ -76,10 +76,10 @@ for path, labels, split in ROBOFLOW_PATHS_UNLABELED:
     remap_labels(f"{dataset_path}/labels/train", labels)
     remap_labels(f"{dataset_path}/labels/valid", labels)
 
-    dataset = YOLODataset(dataset_path, ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "A", "E", "e", "G", "M", "W"], ["train", "valid"]) 
+    dataset = YOLODataset(dataset_path, ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "A", "E", "e", "G", "M", "W"], ["train", "valid"], cache=True) 
     
     bus_stitcher = BusNumberStitcher(dataset, stitch_crops_dataset, pretrained_model)
-    bus_stitcher.stitch("data_stitched")
+    bus_stitcher.stitch("data_stitched", workers=os.cpu_count())
 
 # Train model
 train_model("number-1.pt.pt", "number_default.yaml", "number_data.yaml")    
\ No newline at end of file
@@ -43,7 +43,7 @@ for path, labels, split in ROBOFLOW_PATHS_UNLABELED:
     remap_labels(f"{dataset_path}/labels/train", labels)
     remap_labels(f"{dataset_path}/labels/valid", labels)
 
-    dataset = YOLODataset(dataset_path, ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "A", "E", "e", "G", "M", "W"], ["train", "valid"]) 
+    dataset = YOLODataset(dataset_path, ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "A", "E", "e", "G", "M", "W"], ["train", "valid"], cache=True) 
     crop_output = dataset.crop_bus_with_number(f"./bus_crops", 16, [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15])
 
 
@@ -62,7 +62,7 @@ for path, labels, split in ROBOFLOW_PATHS_UNLABELED:
     remap_labels(f"{dataset_path}/labels/train", labels)
     remap_labels(f"{dataset_path}/labels/valid", labels)
 
-    dataset = YOLODataset(dataset_path, ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9"], ["train", "valid"]) 
+    dataset = YOLODataset(dataset_path, ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9"], ["train", "valid"], cache=True) 
     crop_output = dataset.crop_bus_with_number_using_model(f"./bus_crops", model, [0, 1, 2, 3, 4, 5, 6, 7, 8, 9])
     output_paths_unlabeled.append(crop_output)
 
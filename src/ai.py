@@ -1,4 +1,6 @@
 from ultralytics import YOLO
+import os
+import yaml
 import logging
 from tqdm import tqdm
 
@@ -6,14 +8,39 @@ from tqdm import tqdm
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def train_model(model_name: str, config_path: str, data_path: str):
+def train_model(model_name: str, config_path: str, data_path: str, resize: bool = False,
+                synthetic: dict | None = None):
+    """
+    Train a model, with resize=True the dataset is first downscaled to the imgsz
+    of the config (see resize_dataset) and training reads the resized copy.
+
+    With synthetic set to SyntheticYOLODataset keyword arguments (backgrounds, parts, ...)
+    the training samples are composed on the fly instead of read from the train split,
+    the val split of the data YAML is still used for validation.
+    """
     logger.info(f"Starting training with model: {model_name}")
     logger.info(f"Config: {config_path}, Data: {data_path}")
+
+    if resize:
+        from .resize import resize_dataset
+
+        with open(config_path, "r") as f:
+            imgsz = yaml.safe_load(f).get("imgsz", 640)
+        if isinstance(imgsz, list):
+            imgsz = max(imgsz)
+        data_path = resize_dataset(data_path, imgsz, workers=os.cpu_count())
     
     model = YOLO(model_name)
     
     # Training progress is handled by ultralytics internally
-    model.train(data=data_path, cfg=config_path)
+    if synthetic is not None:
+        # Only needed here and pulls in the Ultralytics trainer internals
+        from .synthetic_dataset import synthetic_trainer
+
+        logger.info(f"Training on synthetic samples: {synthetic}")
+        model.train(data=data_path, cfg=config_path, trainer=synthetic_trainer(**synthetic))
+    else:
+        model.train(data=data_path, cfg=config_path)
     
     output_path = f"{model_name}.pt"
     model.save(output_path)
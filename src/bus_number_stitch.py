@@ -1,28 +1,206 @@
 import os
-import random
 import cv2
 import numpy as np
 import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from tqdm import tqdm
 from .stitching import StitchingCrops
-from .data_wrangler import YOLODataset
+from .data_wrangler import YOLODataset, _batched, _contained
 from ultralytics import YOLO
 
 # Set up logger
 logger = logging.getLogger(__name__)
 
+# Crop bank of the stitching workers, set once per worker by the pool initializer
+_worker_crops = None
+
+
+def _init_stitch_worker(crops: StitchingCrops):
+    global _worker_crops
+    _worker_crops = crops
+
+
+def _stitch_variants(crops: StitchingCrops, task: tuple) -> int:
+    """Stitch every variant of one bus, each on its own copy of the crop."""
+    bus_crop, numbers, variants = task
+    return sum(_stitch_bus(crops, bus_crop.copy(), numbers, seed, *output_paths) for seed, output_paths in variants)
+
+
+def _stitch_task(task: tuple) -> int:
+    return _stitch_variants(_worker_crops, task)
+
+
+def _stitch_bus(crops: StitchingCrops, bus_crop: np.ndarray, numbers: np.ndarray, seed: list[int],
+                image_output_path: str, label_output_path: str, no_labels_output_path: str) -> int:
+    """
+    Replace the numbers on one bus crop with stitched number crops and save it.
+
+    Args:
+        crops: crop bank to draw the numbers from
+        bus_crop: the bus, modified in place
+        numbers: (n, 4) float x1, y1, x2, y2 of the labelled numbers relative to the bus crop
+        seed: seed of the crop sampling and augmentation of this bus
+        image_output_path, label_output_path: where the stitched sample is written
+        no_labels_output_path: where a copy with the stitched numbers blacked out is written
+
+    Returns:
+        Number of stitched labels
+    """
+    rng = np.random.default_rng(seed)
+    crop_height, crop_width = bus_crop.shape[:2]
+    new_labels = []
+    placed = []
+
+    for number_x1, number_y1, number_x2, number_y2 in numbers.tolist():
+        # Label is within bus crop area so black out this area and stitch new numbers
+        new_number_x1 = int(number_x1)
+        new_number_x2 = int(number_x2)
+        new_number_y1 = int(number_y1)
+        new_number_y2 = int(number_y2)
+        logger.debug(f"New number crop: {new_number_x1}:{new_number_x2} {new_number_y1}:{new_number_y2}")
+
+        bus_crop[new_number_y1:new_number_y2, new_number_x1:new_number_x2] = 0
+
+        # Stitch number images
+        number_images_to_stitch = int(rng.integers(1, 5))
+        number_height = number_y2 - number_y1
+
+        to_stitch = []
+        for stitched_number_image, chosen_class in crops.get_random_crops(number_images_to_stitch, rng):
+            # reszie to crop height without changing aspect ratio
+            new_height = int(number_height)
+            ratio = new_height / stitched_number_image.shape[0]
+            new_width = int(stitched_number_image.shape[1] * ratio)
+            if new_width < 1 or new_height < 1:
+                continue
+            stitched_number_image = cv2.resize(stitched_number_image, (new_width, new_height))
+            to_stitch.append((stitched_number_image, chosen_class))
+
+        # Stitch side by side
+        previous_x_end = 0
+        for stitched_number_image, chosen_class in to_stitch:
+            starting_x1 = int(new_number_x1 + previous_x_end)
+            starting_y1 = int(new_number_y1)
+            ending_x2 = int(starting_x1 + stitched_number_image.shape[1])
+            ending_y2 = int(starting_y1 + stitched_number_image.shape[0])
+
+            # check if the stitched number image is within the bus crop
+            if starting_x1 >= 0 and ending_x2 <= crop_width and starting_y1 >= 0 and ending_y2 <= crop_height:
+                bus_crop[starting_y1:ending_y2, starting_x1:ending_x2] = stitched_number_image
+                previous_x_end += stitched_number_image.shape[1]
+
+                # Add label
+                new_labels.append({
+                    "x_center": (starting_x1 + ending_x2) / 2 / crop_width,
+                    "y_center": (starting_y1 + ending_y2) / 2 / crop_height,
+                    "width": stitched_number_image.shape[1] / crop_width,
+                    "height": stitched_number_image.shape[0] / crop_height,
+                    "class": chosen_class
+                })
+                placed.append((starting_x1, starting_y1, ending_x2, ending_y2))
+            else:
+                logger.debug(f"Stitched number image is out of bounds: {starting_x1}:{ending_x2} {starting_y1}:{ending_y2}, bus crop shape: {bus_crop.shape}")
+
+    # Save bus crop
+    cv2.imwrite(image_output_path, bus_crop)
+    with open(label_output_path, "w") as f:
+        for label in new_labels:
+            f.write(f"{label['class']} {label['x_center']} {label['y_center']} {label['width']} {label['height']}\n")
+
+    # Save a copy of bus crop for label-less background, with the stitched numbers blacked out
+    for x1, y1, x2, y2 in placed:
+        bus_crop[y1:y2, x1:x2] = 0
+    cv2.imwrite(no_labels_output_path, bus_crop)
+    logger.debug(f"Saved bus crop: {image_output_path}")
+    return len(new_labels)
+
+
 class BusNumberStitcher:
-    def __init__(self, background_dataset: YOLODataset, bus_number_dataset: YOLODataset, bus_detector: YOLO):
-        self.background_dataset = background_dataset.labels
+    def __init__(self, background_dataset: YOLODataset, bus_number_dataset: StitchingCrops, bus_detector: YOLO):
+        self.background_dataset = background_dataset
         self.bus_number_dataset = bus_number_dataset
         self.bus_detector = bus_detector
         logger.info("Initialized BusNumberStitcher")
 
         # Assume class 0 in background dataset is the joined bus number
 
-    def stitch(self, output_path: str):
+    def _tasks(self, output_path: str, seed: int, batch_size: int, variants_per_bus: int = 1):
+        """Detect buses in batches of backgrounds and yield one stitching task per bus."""
+        # Backgrounds are decoded ahead on a background thread
+        backgrounds = self.background_dataset.iter_samples(prefetch_images=True, prefetch=batch_size * 2)
+
+        # Samples are numbered before filtering, so seeds do not depend on the batch size
+        for batch in _batched(enumerate(backgrounds), batch_size):
+            batch = [(sample_index, background) for sample_index, background in batch if background["available_classes"]]
+            for _, background in batch:
+                if background["image"] is None:
+                    logger.warning(f"Could not load image: {background['image_path']}")
+            batch = [(sample_index, background) for sample_index, background in batch if background["image"] is not None]
+            if not batch:
+                continue
+
+            # Find buses using model, nothing is saved by ultralytics
+            results = self.bus_detector.predict([background["image"] for _, background in batch], save=False, verbose=False)
+
+            for (sample_index, background), result in zip(batch, results):
+                image = background["image"]
+                split = background["split"]
+                name = os.path.basename(background["image_path"])
+                image_height, image_width = image.shape[:2]
+
+                # Labels in pixel x1, y1, x2, y2
+                labels = np.array([[label["x_center"], label["y_center"], label["width"], label["height"]]
+                                   for label in background["labels"]], dtype=np.float64).reshape(-1, 4)
+                scale = np.array([image_width, image_height], dtype=np.float64)
+                centers, sizes = labels[:, :2] * scale, labels[:, 2:] * scale
+                numbers = np.concatenate([centers - sizes / 2, centers + sizes / 2], axis=1)
+
+                bus_boxes = result.boxes.xyxy.cpu().numpy().astype(int).reshape(-1, 4)
+                logger.debug(f"Detected {len(bus_boxes)} buses in image")
+                inside = _contained(bus_boxes, numbers, strict=False)
+
+                for index, (x1, y1, x2, y2) in enumerate(bus_boxes.tolist()):
+                    # Crop the bus, a view as every variant stitches on its own copy
+                    bus_crop = image[y1:y2, x1:x2]
+                    if bus_crop.size == 0:
+                        continue
+
+                    # Variant 0 keeps the names and seed of a single variant run
+                    variants = []
+                    for variant in range(variants_per_bus):
+                        stem = f"{name}_{index}" if variant == 0 else f"{name}_{index}_v{variant}"
+                        variants.append((
+                            [seed, sample_index, index] if variant == 0 else [seed, sample_index, index, variant],
+                            (
+                                os.path.join(output_path, "images", split, f"{stem}.jpg"),
+                                os.path.join(output_path, "labels", split, f"{stem}.txt"),
+                                os.path.join(output_path, "images", split, f"{stem}_no_labels.jpg"),
+                            ),
+                        ))
+
+                    yield bus_crop, numbers[inside[index]] - [x1, y1, x1, y1], variants
+
+    def stitch(self, output_path: str, seed: int | None = None, batch_size: int = 16, workers: int = 1,
+               use_processes: bool = False, variants_per_bus: int = 1):
+        """
+        Args:
+            output_path: root of the stitched YOLO dataset
+            seed: seed of the number crop sampling and augmentation, for repeatable runs.
+                  Every bus gets its own seed derived from this one, so the output does
+                  not depend on the number of workers
+            batch_size: number of backgrounds per bus detector call
+            workers: number of stitching workers, detection stays in this process
+            use_processes: stitch in processes instead of threads. The crops are pickled
+                           once per worker, use an atlas backed StitchingCrops and run
+                           from a script guarded by if __name__ == "__main__"
+            variants_per_bus: differently stitched samples per detected bus, all from one
+                              decode and detection. Extra variants are named <image>_<bus>_v<k>
+        """
         logger.info(f"Starting stitching process. Output path: {output_path}")
+        if seed is None:
+            seed = int(np.random.SeedSequence().entropy % (2 ** 63))
 
         # Create output directory
         os.makedirs(output_path, exist_ok=True)
@@ -34,144 +212,33 @@ class BusNumberStitcher:
 
         os.makedirs(os.path.join(output_path, "images", "valid"), exist_ok=True)
         os.makedirs(os.path.join(output_path, "labels", "valid"), exist_ok=True)
-        
+
         logger.info("Created output directory structure")
 
-        # Iterate over background dataset
-        for background in tqdm(self.background_dataset):
-            
-            if not background["available_classes"]: 
-                continue
-            
-            split = background["split"]
-            labels = background["labels"]
-
-            # Find bus using model
-            image = cv2.imread(background["image_path"])
-            if image is None:
-                logger.warning(f"Could not load image: {background['image_path']}")
-                continue
-                
-            bus_image_width = image.shape[1]
-            bus_image_height = image.shape[0]
-
-            results = self.bus_detector.predict(image, save=True)
-
-            # Get bus crop
-            bus_coords = results[0].boxes.xyxy 
-            logger.debug(f"Detected {len(bus_coords)} buses in image")
-            
-            for index, coord in enumerate(bus_coords):
-                x1 = int(coord[0])
-                y1 = int(coord[1])
-                x2 = int(coord[2])
-                y2 = int(coord[3])
-
-                print(f"Bus crop: {x1}:{x2} {y1}:{y2}")
-
-                bus_crop_output_path = os.path.join(output_path, "images", split, f"{os.path.basename(background['image_path'])}_{index}.jpg")
-                bus_crop_output_label_path = os.path.join(output_path, "labels", split, f"{os.path.basename(background['image_path'])}_{index}.txt")
-
-                # Crop the bus
-                bus_crop = image[y1:y2, x1:x2]
-                print(f"Bus crop shape: {bus_crop.shape}")
-                new_labels = []
-
-                # Find labels within bus crop area
-                for number_label in labels:
-                    number_x_center = number_label["x_center"] * bus_image_width
-                    number_y_center = number_label["y_center"] * bus_image_height
-                    number_width = number_label["width"] * bus_image_width
-                    number_height = number_label["height"] * bus_image_height
-
-                    number_x1 = number_x_center - number_width / 2
-                    number_x2 = number_x_center + number_width / 2
-                    number_y1 = number_y_center - number_height / 2
-                    number_y2 = number_y_center + number_height / 2
-
-                    print(f"Number label: {number_x1}:{number_x2} {number_y1}:{number_y2}")
-
-                    if number_x1 >= x1 and number_x2 <= x2 and number_y1 >= y1 and number_y2 <= y2:
-                        # Label is within bus crop area so black out this area and stitch new numbers
-
-                        # Re-nomralise to crop 
-                        new_number_x1 = int(number_x1 - x1) 
-                        new_number_x2 = int(number_x2 - x1) 
-                        new_number_y1 = int(number_y1 - y1)
-                        new_number_y2 = int(number_y2 - y1)
-
-                        print(f"New number crop: {new_number_x1}:{new_number_x2} {new_number_y1}:{new_number_y2}")
-
-                        bus_crop[new_number_y1:new_number_y2, new_number_x1:new_number_x2] = 0 
-
-                        
-
-                        crop_width = new_number_x2 - new_number_x1
-                        crop_height = new_number_y2 - new_number_y1
-
-                        # Stitch number images
-                        number_images_to_stitch = random.choice([1,2,3,4])
-
-                        to_stitch = []
-                        for _ in range(number_images_to_stitch):
-                            stitched_number_image, chosen_class = self.bus_number_dataset.get_random_crop()
-                            # reszie to crop height without changing aspect ratio
-                            new_height = int(number_height)
-                            ratio = new_height / stitched_number_image.shape[0]
-                            new_width = int(stitched_number_image.shape[1] * ratio)
-                            print(f"Resizing to {new_width}x{new_height}")
-                            stitched_number_image = cv2.resize(stitched_number_image, (new_width, new_height))
-
-                            to_stitch.append((stitched_number_image, chosen_class))
-
-                        # Stitch side by side
-                        previous_x_end = 0
-                        for index, (stitched_number_image, chosen_class) in enumerate(to_stitch):
-                            starting_x1 = int(new_number_x1 + previous_x_end)
-                            starting_y1 = int(new_number_y1)
-                            ending_x2 = int(starting_x1 + stitched_number_image.shape[1])
-                            ending_y2 = int(starting_y1 + stitched_number_image.shape[0])
-
-                            print(f"Stitching at {starting_x1}:{ending_x2} {starting_y1}:{ending_y2}, bus crop shape: {bus_crop.shape}")
-                            
-                            # check if the stitched number image is within the bus crop
-                            if starting_x1 >= 0 and ending_x2 <= bus_crop.shape[1] and starting_y1 >= 0 and ending_y2 <= bus_crop.shape[0]:
-                                bus_crop[starting_y1:ending_y2, starting_x1:ending_x2] = stitched_number_image
-                                previous_x_end += stitched_number_image.shape[1] 
-
-                                # Add label
-                                new_labels.append({
-                                    "x_center": (starting_x1 + ending_x2) / 2 / bus_crop.shape[1],
-                                    "y_center": (starting_y1 + ending_y2) / 2 / bus_crop.shape[0],
-                                    "width": stitched_number_image.shape[1] / bus_crop.shape[1],
-                                    "height": stitched_number_image.shape[0] / bus_crop.shape[0],
-                                    "class": chosen_class
-                                })
-                            else:
-                                print(f"Stitched number image is out of bounds: {starting_x1}:{ending_x2} {starting_y1}:{ending_y2}, bus crop shape: {bus_crop.shape}")
-                                continue
-
-                # Save bus crop
-                cv2.imwrite(bus_crop_output_path, bus_crop)
-                with open(bus_crop_output_label_path, "w") as f:
-                    for label in new_labels:
-                        f.write(f"{label['class']} {label['x_center']} {label['y_center']} {label['width']} {label['height']}\n")
-                
-                # Save a copy of bus crop for label-less background
-                # Loop thru labels and de-normalise to bus crop
-                # Black out the labels
-                temp_bus_crop = bus_crop.copy()
-                for label in new_labels:
-                    label["x_center"] = label["x_center"] * bus_crop.shape[1]
-                    label["y_center"] = label["y_center"] * bus_crop.shape[0]
-                    label["width"] = label["width"] * bus_crop.shape[1]
-                    label["height"] = label["height"] * bus_crop.shape[0]
-
-                    temp_bus_crop[int(label["y_center"] - label["height"] / 2):int(label["y_center"] + label["height"] / 2), int(label["x_center"] - label["width"] / 2):int(label["x_center"] + label["width"] / 2)] = 0
-
-                bus_crop_output_path_no_labels = os.path.join(output_path, "images", split, f"{os.path.basename(background['image_path'])}_{index}_no_labels.jpg")
-                cv2.imwrite(bus_crop_output_path_no_labels, temp_bus_crop)
-                logger.debug(f"Saved bus crop: {bus_crop_output_path}")
-        
+        tasks = self._tasks(output_path, seed, batch_size, variants_per_bus)
+        progress = tqdm(desc="Stitching buses")
+        total_labels = 0
+
+        if workers <= 1:
+            for task in tasks:
+                total_labels += _stitch_variants(self.bus_number_dataset, task)
+                progress.update(1)
+        else:
+            pool_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+            with pool_class(max_workers=workers, initializer=_init_stitch_worker,
+                            initargs=(self.bus_number_dataset,)) as pool:
+                # Detection runs ahead of the workers by at most workers * 4 buses
+                pending = deque()
+                for task in tasks:
+                    pending.append(pool.submit(_stitch_task, task))
+                    while len(pending) >= workers * 4:
+                        total_labels += pending.popleft().result()
+                        progress.update(1)
+                while pending:
+                    total_labels += pending.popleft().result()
+                    progress.update(1)
+        progress.close()
+
+        logger.info(f"Stitched {progress.n} buses into {progress.n * variants_per_bus} samples with {total_labels} number labels")
+        logger.info(f"Crop cache: {self.bus_number_dataset.cache_info()}")
         logger.info("Stitching process completed successfully")
-                            
\ No newline at end of file
@@ -1,10 +1,25 @@
 import os
+import json
+import time
+import queue
 import random
-import shutil
+import threading
 import cv2
 import logging
+import numpy as np
+from collections import deque
+from functools import partial
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
 from tqdm import tqdm
 from ultralytics import YOLO
+from ultralytics.utils.plotting import save_one_box
+
+from .image_index import IMAGE_EXTENSIONS, is_image, read_image_sizes
+from .label_cache import SplitIndex, index_path
+from .label_store import LabelStore, denormalise_boxes, parse_label_file
+from .utils import link_or_copy, remove_if_exists
 
 """
 
@@ -33,11 +48,335 @@ Folder
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def _pool_map(fn, items: list, workers: int = 1, processes: bool = False, desc: str | None = None) -> list:
+    """
+    Ordered map of fn over items with a progress bar.
+
+    Runs in-process for workers <= 1, otherwise on a thread pool (I/O bound work)
+    or a process pool (CPU bound work, fn must be a module level function).
+    """
+    if workers <= 1:
+        return list(tqdm(map(fn, items), total=len(items), desc=desc))
+
+    pool_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    chunksize = max(1, len(items) // (workers * 8)) if processes else 1
+    with pool_class(max_workers=workers) as pool:
+        return list(tqdm(pool.map(fn, items, chunksize=chunksize), total=len(items), desc=desc))
+
+
+def _pool_imap(fn, items, workers: int = 1, processes: bool = False):
+    """
+    Ordered lazy map of fn over any iterable.
+
+    Unlike Executor.map, items are only pulled from the iterable while fewer than
+    workers * 4 tasks are in flight, so streaming inputs stay in bounded memory.
+    """
+    if workers <= 1:
+        yield from map(fn, items)
+        return
+
+    pool_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with pool_class(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _prefetch(items, load, depth: int = 8):
+    """
+    Yield (item, load(item)) pairs with load running on a background thread.
+
+    At most depth loaded items are buffered. Exceptions raised by the producer are
+    re-raised in the consumer, and closing the generator stops the producer.
+    """
+    results = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+    done = object()
+
+    def put(value):
+        while not stop.is_set():
+            try:
+                results.put(value, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def producer():
+        try:
+            for item in items:
+                if stop.is_set():
+                    return
+                put((item, load(item), None))
+        except Exception as e:
+            put((done, None, e))
+            return
+        put((done, None, None))
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, loaded, error = results.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item, loaded
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _batched(items, size: int):
+    """Yield lists of up to size consecutive items."""
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _list_images(images_path: str) -> dict[str, str]:
+    """
+    Map file stem to image file name with a single directory listing.
+
+    Extensions match like list_images, in any case. When several images share a stem
+    the extension earliest in IMAGE_EXTENSIONS wins.
+    """
+    found = {}
+    if not os.path.isdir(images_path):
+        return found
+
+    with os.scandir(images_path) as entries:
+        for entry in entries:
+            if not is_image(entry.name):
+                continue
+            stem, ext = os.path.splitext(entry.name)
+            current = found.get(stem)
+            if current is None or (IMAGE_EXTENSIONS.index(ext.lower())
+                                   < IMAGE_EXTENSIONS.index(os.path.splitext(current)[1].lower())):
+                found[stem] = entry.name
+    return found
+
+
+def _crop_image(task: tuple) -> int:
+    """Write every crop of the filtered classes in one image, returns the number of crops saved."""
+    image_path, split, classes, boxes, crop_filter, class_names, output_path = task
+    output_path_image = os.path.join(output_path, split)
+    count = 0
+
+    # Load original image once per file
+    original_image = cv2.imread(image_path)
+    if original_image is None:
+        logger.warning(f"Could not load image: {image_path}")
+        return 0
+        
+    # Get dimensions from the loaded image
+    image_height, image_width = original_image.shape[:2]
+
+    # De normalise all bounding boxes of the filtered classes at once
+    keep = np.isin(classes, crop_filter)
+    coords = denormalise_boxes(boxes[keep], image_width, image_height).astype(int)
+
+    for obj_class, (x1, y1, x2, y2) in zip(classes[keep].tolist(), coords.tolist()):
+        try:
+            # Crop the image
+            cropped_image = original_image[y1:y2, x1:x2]
+
+            # Save the image, directories are created up front
+            class_name = class_names[obj_class]
+            class_output_dir = os.path.join(output_path_image, class_name)
+            output_path_full = os.path.join(class_output_dir, os.path.basename(image_path).replace(".", f"_{count}."))
+            cv2.imwrite(output_path_full, cropped_image)   
+
+            count += 1
+        except:
+            print("Error cropping images")
+    return count
+
+
+def _black_out(image: np.ndarray, boxes: np.ndarray) -> None:
+    """
+    Set the pixels covered by any of the pixel x1, y1, x2, y2 boxes to zero, in place.
+
+    All boxes are rasterised at once: corners go into a 2D difference array whose
+    cumulative sum is the coverage mask.
+    """
+    image_height, image_width = image.shape[:2]
+
+    # Add bounds checking to prevent array out of bounds
+    boxes = np.clip(np.asarray(boxes).astype(int).reshape(-1, 4), 0, [image_width, image_height, image_width, image_height])
+    boxes = boxes[(boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])]
+    if len(boxes) == 0:
+        return
+
+    x1, y1, x2, y2 = boxes.T
+    coverage = np.zeros((image_height + 1, image_width + 1), dtype=np.int32)
+    np.add.at(coverage, (y1, x1), 1)
+    np.add.at(coverage, (y1, x2), -1)
+    np.add.at(coverage, (y2, x1), -1)
+    np.add.at(coverage, (y2, x2), 1)
+    mask = coverage.cumsum(axis=0).cumsum(axis=1)[:image_height, :image_width] > 0
+    image[mask] = 0
+
+
+def _remove_classes_image(task: tuple) -> int:
+    """Write a blacked-out copy of one image and its filtered label file, returns the number of removed objects."""
+    image_path, label_path, output_image_path, output_label_path, classes, boxes, remove_filter = task
+    remove = np.isin(classes, remove_filter)
+
+    image = cv2.imread(image_path)
+    if image is None:
+        # The boxes are still dropped from the label, only the pixels stay
+        logger.warning(f"Could not load image, copying it without blacking out: {image_path}")
+        if os.path.exists(image_path):
+            link_or_copy(image_path, output_image_path)
+    else:
+        image_height, image_width = image.shape[:2]
+        _black_out(image, denormalise_boxes(boxes[remove], image_width, image_height))
+        remove_if_exists(output_image_path)
+        cv2.imwrite(output_image_path, image)
+
+    # Keep every other line of the label file as it was
+    with open(label_path, "r") as f:
+        lines = f.readlines()
+    remove_if_exists(output_label_path)
+    with open(output_label_path, "w") as f:
+        for line in lines:
+            parts = line.split()
+            if parts and parts[0].lstrip("-").isdigit() and int(parts[0]) in remove_filter:
+                continue
+            f.write(line)
+
+    return int(remove.sum())
+
+
+def _contained(outer: np.ndarray, inner: np.ndarray, strict: bool = True) -> np.ndarray:
+    """
+    Containment matrix of pixel x1, y1, x2, y2 boxes.
+
+    Returns:
+        (len(outer), len(inner)) bool array, True where inner[j] lies inside outer[i]
+    """
+    outer = np.asarray(outer, dtype=np.float64).reshape(-1, 1, 4)
+    inner = np.asarray(inner, dtype=np.float64).reshape(1, -1, 4)
+    if strict:
+        return ((inner[..., 0] > outer[..., 0]) & (inner[..., 2] < outer[..., 2])
+                & (inner[..., 1] > outer[..., 1]) & (inner[..., 3] < outer[..., 3]))
+    return ((inner[..., 0] >= outer[..., 0]) & (inner[..., 2] <= outer[..., 2])
+            & (inner[..., 1] >= outer[..., 1]) & (inner[..., 3] <= outer[..., 3]))
+
+
+def _write_bus_crop(image: np.ndarray, bus_box: list[int], number_classes: np.ndarray, number_centers: np.ndarray,
+                    number_sizes: np.ndarray, image_output_path: str, label_output_path: str,
+                    no_labels_output_path: str | None = None) -> bool:
+    """
+    Save a bus crop, the numbers inside it as YOLO labels and optionally a copy with the numbers blacked out.
+
+    Args:
+        bus_box: integer pixel x1, y1, x2, y2 of the bus
+        number_classes, number_centers, number_sizes: numbers inside the bus in image pixels
+    """
+    bus_x1, bus_y1, bus_x2, bus_y2 = bus_box
+    bus_width = bus_x2 - bus_x1
+    bus_height = bus_y2 - bus_y1
+
+    # Crop bus image
+    bus_crop = image[bus_y1:bus_y2, bus_x1:bus_x2]
+
+    # Normalise the labels to the bus crop
+    centers = number_centers - [bus_x1, bus_y1]
+    normalised = np.concatenate([centers, number_sizes], axis=1) / [bus_width, bus_height, bus_width, bus_height]
+
+    # Save the bus crop
+    try:
+        cv2.imwrite(image_output_path, bus_crop)
+    except:
+        print("Error saving bus crop")
+        return False
+
+    # Save the labels
+    with open(label_output_path, "w") as f:
+        for obj_class, (x_center, y_center, width, height) in zip(number_classes.tolist(), normalised.tolist()):
+            f.write(f"{obj_class} {x_center} {y_center} {width} {height}\n")
+
+    if no_labels_output_path is None:
+        return True
+
+    # save a copy of bus crop for label-less background
+    bus_crop_no_labels = bus_crop.copy()
+    _black_out(bus_crop_no_labels, np.concatenate([centers - number_sizes / 2, centers + number_sizes / 2], axis=1))
+    cv2.imwrite(no_labels_output_path, bus_crop_no_labels)
+    return True
+
+
+def _crop_bus_with_number_image(task: tuple) -> int:
+    """Crop every labelled bus of one image with the numbers inside it, returns the number of buses."""
+    image_path, split, classes, boxes, bus_index, number_indices, output_path = task
+
+    # Get bus image once for all of its buses
+    image = cv2.imread(image_path)
+    if image is None:
+        logger.warning(f"Could not load image: {image_path}")
+        return 0
+    image_height, image_width = image.shape[:2]
+
+    # Bus and number boxes in pixels
+    scale = np.array([image_width, image_height], dtype=np.float64)
+    bus_boxes = denormalise_boxes(boxes[classes == bus_index], image_width, image_height).astype(int)
+    is_number = np.isin(classes, number_indices)
+    number_classes = classes[is_number]
+    number_centers = boxes[is_number, :2].astype(np.float64) * scale
+    number_sizes = boxes[is_number, 2:].astype(np.float64) * scale
+
+    # Numbers within each bus bounding box, for all buses at once
+    inside = _contained(bus_boxes, np.concatenate([number_centers - number_sizes / 2, number_centers + number_sizes / 2], axis=1))
+
+    name = os.path.basename(image_path)
+    for index, bus_box in enumerate(bus_boxes.tolist()):
+        matched = inside[index]
+        _write_bus_crop(
+            image, bus_box, number_classes[matched], number_centers[matched], number_sizes[matched],
+            os.path.join(output_path, "images", split, f"{name}_{index}.jpg"),
+            os.path.join(output_path, "labels", split, f"{name}_{index}.txt"),
+            os.path.join(output_path, "images", split, f"{name}_{index}_no_labels.jpg"),
+        )
+    return len(bus_boxes)
+
+
+def _distribution(values: np.ndarray, bins: int = 10) -> dict:
+    """Summary statistics and histogram of a 1D array, JSON serialisable."""
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return {"count": 0}
+    percentiles = np.percentile(values, [0, 5, 25, 50, 75, 95, 100])
+    counts, edges = np.histogram(values, bins=bins)
+    return {
+        "count": int(len(values)),
+        "mean": float(values.mean()),
+        "std": float(values.std()),
+        "percentiles": dict(zip(["min", "p5", "p25", "p50", "p75", "p95", "max"], percentiles.tolist())),
+        "histogram": {"counts": counts.tolist(), "edges": edges.tolist()},
+    }
+
+
 class YOLODataset:
-    def __init__(self, path: str, classes: list[str], splits_use: list[str] = ["train", "valid", "test"]):
+    def __init__(self, path: str, classes: list[str], splits_use: list[str] = ["train", "valid", "test"],
+                 columnar: bool = False, workers: int = 1, use_processes: bool = False, cache: bool = False,
+                 lazy: bool = False, classes_of_interest: list[int] | None = None):
         self.path = path
         self.classes = classes
         self.splits_use = splits_use
+
+        # Label files are parsed on a thread pool (or process pool) when workers > 1
+        self.workers = workers
+        self.use_processes = use_processes
+
+        # With cache=True parsed labels are kept in labels/<split>.index.npz and
+        # only new or changed label files are parsed again
+        self.cache = cache
         
         # No need load images
         self.labels = []
@@ -60,14 +399,36 @@ class YOLODataset:
         #     "height": float
         # }
 
+        # With columnar=True the labels live in a LabelStore (one float32 box array,
+        # per-image offsets) and self.labels is a read-only view in the format above
+        self.columnar = columnar
+        self.store: LabelStore | None = None
+
+        # With lazy=True nothing is loaded up front, labels are streamed from disk
+        # by iter_samples and the methods below work one image at a time
+        self.lazy = lazy
+
+        # Boxes of other classes are dropped while parsing, files left without
+        # boxes are skipped entirely
+        self.classes_of_interest = None if classes_of_interest is None else frozenset(classes_of_interest)
+
+        # Header-only image sizes, see image_sizes()
+        self._image_sizes = None
+        self._split_indexes = {}
+        self._label_file_counts = {}
+
         logger.info(f"Initializing YOLO dataset from: {path}")
         logger.info(f"Classes: {classes}")
         logger.info(f"Splits: {splits_use}")
-        self.load_data()
+        if not lazy:
+            self.load_data()
 
     def load_data(self):
         logger.info("Loading dataset metadata...")
         total_files = 0
+        entries = []
+        self._image_sizes = None
+        self._label_file_counts = {}
         
         for split in self.splits_use:
             labels_path = os.path.join(self.path, "labels", split) 
@@ -75,77 +436,372 @@ class YOLODataset:
                 logger.warning(f"Labels path not found: {labels_path}")
                 continue
 
-            # Filter only .txt files for efficiency
-            label_files = [f for f in os.listdir(labels_path) if f.endswith('.txt')]
-            logger.info(f"Found {len(label_files)} label files in {split} split")
-            
-            # walk through all label files
-            for file in tqdm(label_files, desc=f"Loading {split} labels"):
-                file_path = os.path.join(labels_path, file)
-                
-                # Skip empty files
-                if os.path.getsize(file_path) == 0:
+            # Resolve images from one listing of images/<split> instead of probing every extension
+            images_path = labels_path.replace("labels", "images", 1)
+
+            if self.cache:
+                index = self._load_split_index(labels_path, images_path, split)
+                self._split_indexes[split] = (index, labels_path, images_path)
+                if self.classes_of_interest is not None:
+                    # The index always holds every class so it can serve any filter
+                    index = index.select_classes(self.classes_of_interest)
+                label_files = index.names
+                image_names = index.image_names
+                parsed = [index.file_labels(row) for row in range(len(index))]
+            else:
+                # Filter only .txt files for efficiency
+                label_files = [f for f in os.listdir(labels_path) if f.endswith('.txt')]
+                logger.info(f"Found {len(label_files)} label files in {split} split")
+
+                image_files = _list_images(images_path)
+                image_names = [image_files.get(os.path.splitext(file)[0], file) for file in label_files]
+
+                # Parse all label files, empty files come back without any labels
+                file_paths = [os.path.join(labels_path, file) for file in label_files]
+                parse = partial(parse_label_file, classes_of_interest=self.classes_of_interest)
+                parsed = _pool_map(parse, file_paths, self.workers, self.use_processes,
+                                   desc=f"Loading {split} labels")
+
+            for file, image_file, (classes, boxes) in zip(label_files, image_names, parsed):
+                if len(classes) == 0:  # Only add if there are valid labels
                     continue
-                    
-                with open(file_path, "r") as f:
-                    # Read the file line by line
-                    overall_dict = {}
-
-                    label_path = file_path
-                    image_path = label_path.replace("labels", "images", 1)
-                    
-                    # Change extension from .txt to common image formats
-                    base_name = os.path.splitext(image_path)[0]
-                    for ext in ['.jpg', '.jpeg', '.png', '.bmp']:
-                        potential_image = base_name + ext
-                        if os.path.exists(potential_image):
-                            image_path = potential_image
-                            break
-
-                    overall_dict["image_path"] = image_path
-                    overall_dict["label_path"] = label_path
-
-                    overall_dict["labels"] = []
-                    overall_dict["split"] = split
-
-                    for line in f:
-                        line = line.strip()
-                        if not line:  # Skip empty lines
-                            continue
-                            
-                        # Split the line into parts
-                        parts = line.split()
-                        if len(parts) != 5:  # Skip malformed lines
-                            continue
-                            
-                        try:
-                            # The first part is the class
-                            obj_class = int(parts[0]) 
-                            x_center = float(parts[1])
-                            y_center = float(parts[2])
-                            width = float(parts[3])
-                            height = float(parts[4])
-
-                            overall_dict["labels"].append({
-                                "obj_class": obj_class,
-                                "x_center": x_center,
-                                "y_center": y_center,
-                                "width": width,
-                                "height": height
-                            })
-                        except ValueError:
-                            # Skip lines with invalid data
-                            continue
-                    
-                    if overall_dict["labels"]:  # Only add if there are valid labels
-                        available_classes = set([label["obj_class"] for label in overall_dict["labels"]])
-                        overall_dict["available_classes"] = available_classes
-                        self.labels.append(overall_dict)
-                        total_files += 1
+
+                image_path = os.path.join(images_path, image_file)
+                entries.append((image_path, os.path.join(labels_path, file), split, classes, boxes))
+                total_files += 1
+            self._label_file_counts[split] = len(label_files)
             logger.info(f"Loaded {len(label_files)} files with {split} valid samples")
+
+        if self.columnar:
+            self.store = LabelStore.from_parsed(entries)
+            self.labels = self.store.records()
+        else:
+            self.labels = [self._make_record(*entry) for entry in entries]
         logger.info(f"Loaded {total_files} files with {len(self.labels)} valid samples")
 
-    def crop_images(self, output_path: str, crop_filter: list[int]): 
+    def _load_split_index(self, labels_path: str, images_path: str, split: str) -> SplitIndex:
+        """Load the label index of a split, re-parsing only label files whose size or mtime changed."""
+        path = index_path(labels_path)
+        cached = SplitIndex.load(path)
+
+        with os.scandir(labels_path) as it:
+            files = [(entry.name, entry.stat()) for entry in it if entry.name.endswith('.txt')]
+        names = [name for name, _ in files]
+        sizes = np.array([stat.st_size for _, stat in files], dtype=np.int64)
+        mtimes = np.array([stat.st_mtime_ns for _, stat in files], dtype=np.int64)
+        images_mtime = os.stat(images_path).st_mtime_ns if os.path.isdir(images_path) else 0
+        logger.info(f"Found {len(names)} label files in {split} split")
+
+        if cached is not None and cached.is_current(names, sizes, mtimes, images_mtime):
+            logger.info(f"Label index up to date, skipped parsing: {path}")
+            return cached
+
+        # Reuse unchanged files from the old index and parse the rest
+        if cached is None:
+            stale = list(range(len(names)))
+        else:
+            stale = [i for i, name in enumerate(names) if not cached.is_unchanged(name, sizes[i], mtimes[i])]
+        logger.info(f"Parsing {len(stale)} new or changed label files in {split} split")
+        parsed = _pool_map(parse_label_file, [os.path.join(labels_path, names[i]) for i in stale],
+                           self.workers, self.use_processes, desc=f"Loading {split} labels")
+        parsed = dict(zip(stale, parsed))
+
+        class_chunks, box_chunks = [], []
+        for i, name in enumerate(names):
+            if i in parsed:
+                classes, boxes = parsed[i]
+                class_chunks.append(np.asarray(classes, dtype=np.int32))
+                box_chunks.append(np.asarray(boxes, dtype=np.float64).reshape(-1, 4))
+            else:
+                classes, boxes = cached.file_labels(cached.rows[name])
+                class_chunks.append(classes)
+                box_chunks.append(boxes)
+
+        offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum([len(classes) for classes in class_chunks], out=offsets[1:])
+
+        # Image names are cheap to resolve again from a single listing
+        image_files = _list_images(images_path)
+        image_names = [image_files.get(os.path.splitext(name)[0], name) for name in names]
+
+        # Image sizes of unchanged files stay valid while the images folder is unchanged
+        image_sizes = None
+        if cached is not None and cached.image_sizes is not None and cached.images_mtime == images_mtime:
+            image_sizes = np.full((len(names), 2), -1, dtype=np.int32)
+            for i, name in enumerate(names):
+                if i not in parsed:
+                    image_sizes[i] = cached.image_sizes[cached.rows[name]]
+
+        index = SplitIndex(
+            names, sizes, mtimes, image_names, images_mtime, offsets,
+            np.concatenate(class_chunks) if class_chunks else np.zeros(0, dtype=np.int32),
+            np.concatenate(box_chunks) if box_chunks else np.zeros((0, 4), dtype=np.float64),
+            image_sizes,
+        )
+        index.save(path)
+        return index
+
+    @staticmethod
+    def _make_record(image_path: str, label_path: str, split: str, classes: list[int], boxes: list[tuple]) -> dict:
+        if isinstance(classes, np.ndarray):
+            # Cached labels come back as arrays
+            classes, boxes = classes.tolist(), boxes.tolist()
+        labels = [
+            {
+                "obj_class": obj_class,
+                "x_center": box[0],
+                "y_center": box[1],
+                "width": box[2],
+                "height": box[3]
+            }
+            for obj_class, box in zip(classes, boxes)
+        ]
+        return {
+            "image_path": image_path,
+            "label_path": label_path,
+            "labels": labels,
+            "split": split,
+            "available_classes": set(classes)
+        }
+
+    def get_store(self) -> LabelStore:
+        """Columnar view of the labels, built from self.labels (or streamed when lazy) when not loaded columnar."""
+        if self.store is not None:
+            return self.store
+        if self.lazy:
+            return LabelStore.from_parsed(self._iter_entries())
+        return LabelStore.from_records(self.labels)
+
+    def class_counts(self) -> np.ndarray:
+        """Number of boxes per class index."""
+        return self.get_store().class_counts(minlength=len(self.classes))
+
+    def image_sizes(self) -> np.ndarray:
+        """
+        Width and height of every image in self.labels, read from image headers only.
+
+        With cache=True the sizes are stored in the label index and only read
+        for images that are new since the last run.
+
+        Returns:
+            (len(self.labels), 2) int32 array, -1 for unreadable images
+        """
+        if self._image_sizes is not None:
+            return self._image_sizes
+
+        sizes = self._read_image_sizes([image_path for image_path, *_ in self._iter_entries()])
+        if not self.lazy:
+            self._image_sizes = sizes
+        return sizes
+
+    def _read_image_sizes(self, image_paths: list[str]) -> np.ndarray:
+        """Header sizes of the given images, through the label index when cache=True (lazy or not)."""
+        if not self.cache:
+            return read_image_sizes(image_paths, max(self.workers, 8))
+
+        known = {}
+        for split in self.splits_use:
+            if split not in self._split_indexes:
+                # Lazy datasets open the index of a split the first time sizes are needed
+                labels_path = os.path.join(self.path, "labels", split)
+                if not os.path.exists(labels_path):
+                    continue
+                images_path = labels_path.replace("labels", "images", 1)
+                self._split_indexes[split] = (self._load_split_index(labels_path, images_path, split), labels_path, images_path)
+
+            index, labels_path, images_path = self._split_indexes[split]
+            if index.fill_image_sizes(images_path, max(self.workers, 8)):
+                index.save(index_path(labels_path))
+            for image_name, size in zip(index.image_names, index.image_sizes):
+                known[os.path.join(images_path, image_name)] = size
+
+        sizes = np.full((len(image_paths), 2), -1, dtype=np.int32)
+        for i, image_path in enumerate(image_paths):
+            size = known.get(image_path)
+            if size is not None and size[0] >= 0:
+                sizes[i] = size
+        return sizes
+
+    def _store_image_sizes(self, store: LabelStore) -> np.ndarray:
+        """Image sizes in the order of store, lazy stores are matched by their own image paths."""
+        if self.lazy:
+            return self._read_image_sizes(store.image_paths)
+        return self.image_sizes()
+
+    def pixel_boxes(self) -> np.ndarray:
+        """Pixel x1, y1, x2, y2 of every box in the label store order, without decoding any image."""
+        store = self.get_store()
+        return store.denormalise(self._store_image_sizes(store))
+
+    def stats(self, json_path: str | None = None, pixel_sizes: bool = True, bins: int = 10) -> dict:
+        """
+        Per split dataset profile computed with NumPy over the label store.
+
+        Reports label file and empty file counts, a class histogram, boxes per image,
+        and distributions of normalised box width, height and area. With pixel_sizes
+        the image sizes are read from headers (see image_sizes) to add pixel box
+        sizes and aspect ratios. Every split of splits_use gets an entry, boxes with
+        negative class ids are counted in negative_class_boxes.
+
+        Args:
+            json_path: also write the report to this JSON file
+            pixel_sizes: include pixel based statistics
+            bins: number of histogram bins for the distributions
+
+        Returns:
+            the report as a dict
+        """
+        store = self.get_store()
+        sizes = self._store_image_sizes(store) if pixel_sizes else None
+        if sizes is not None and len(sizes) != len(store):
+            sizes = None
+
+        boxes_per_image = np.diff(store.offsets)
+        box_split = store.image_split[store.box_image_index]
+        if sizes is not None:
+            pixel = store.denormalise(sizes)
+            pixel_widths = pixel[:, 2] - pixel[:, 0]
+            pixel_heights = pixel[:, 3] - pixel[:, 1]
+            readable = (sizes[store.box_image_index, 0] > 0) & (pixel_heights > 0)
+
+        report = {"path": self.path, "splits": {}}
+        split_codes = {split: code for code, split in enumerate(store.splits)}
+        for split in self.splits_use:
+            # Splits without any labelled image are still reported, with zero counts
+            code = split_codes.get(split, -1)
+            images = store.image_split == code
+            boxes = box_split == code
+            classes = store.classes[boxes]
+            widths = store.boxes[boxes, 2].astype(np.float64)
+            heights = store.boxes[boxes, 3].astype(np.float64)
+
+            label_files = self._label_file_counts.get(split)
+            if label_files is None:
+                labels_path = os.path.join(self.path, "labels", split)
+                label_files = sum(1 for f in os.listdir(labels_path) if f.endswith('.txt')) if os.path.isdir(labels_path) else 0
+
+            # Negative ids only come from hand-edited or foreign label files, count them apart from the histogram
+            negative = classes < 0
+            class_counts = np.bincount(classes[~negative], minlength=len(self.classes)) if (~negative).any() else np.zeros(len(self.classes), dtype=np.int64)
+            per_image = np.bincount(boxes_per_image[images]) if images.any() else np.zeros(0, dtype=np.int64)
+
+            split_report = {
+                "label_files": int(label_files),
+                "images_with_labels": int(images.sum()),
+                "files_without_labels": int(label_files - images.sum()),
+                "boxes": int(boxes.sum()),
+                "negative_class_boxes": int(negative.sum()),
+                "classes": {
+                    (self.classes[class_id] if class_id < len(self.classes) else str(class_id)): int(count)
+                    for class_id, count in enumerate(class_counts.tolist()) if count
+                },
+                "boxes_per_image": {str(n): int(count) for n, count in enumerate(per_image.tolist()) if count},
+                "box_width": _distribution(widths, bins),
+                "box_height": _distribution(heights, bins),
+                "box_area": _distribution(widths * heights, bins),
+            }
+
+            if sizes is not None:
+                valid = boxes & readable
+                split_report["image_width"] = _distribution(sizes[images & (sizes[:, 0] > 0), 0], bins)
+                split_report["image_height"] = _distribution(sizes[images & (sizes[:, 0] > 0), 1], bins)
+                split_report["box_pixel_width"] = _distribution(pixel_widths[valid], bins)
+                split_report["box_pixel_height"] = _distribution(pixel_heights[valid], bins)
+                split_report["box_aspect_ratio"] = _distribution(pixel_widths[valid] / pixel_heights[valid], bins)
+
+            report["splits"][split] = split_report
+
+        if json_path is not None:
+            os.makedirs(os.path.dirname(json_path) or ".", exist_ok=True)
+            with open(json_path, "w") as f:
+                json.dump(report, f, indent=2)
+            logger.info(f"Dataset statistics written to: {json_path}")
+
+        return report
+
+    def _iter_entries(self, split: str | None = None, classes: list[int] | None = None):
+        """
+        Yield (image_path, label_path, split, classes, boxes) for every image with labels.
+
+        Reads from the loaded labels, or straight from the label files when lazy.
+        """
+        splits = self.splits_use if split is None else [split]
+
+        if not self.lazy:
+            if self.store is not None:
+                store = self.store
+                indices = range(len(store)) if classes is None else store.images_with_classes(classes)
+                for i in indices:
+                    if store.split_of(i) in splits:
+                        yield (store.image_paths[i], store.label_paths[i], store.split_of(i), *store.image_boxes(i))
+                return
+
+            for label in self.labels:
+                if label["split"] not in splits:
+                    continue
+                if classes is not None and not label["available_classes"].intersection(classes):
+                    continue
+                objs = label["labels"]
+                yield (label["image_path"], label["label_path"], label["split"],
+                       [obj["obj_class"] for obj in objs],
+                       [(obj["x_center"], obj["y_center"], obj["width"], obj["height"]) for obj in objs])
+            return
+
+        for split_name in splits:
+            labels_path = os.path.join(self.path, "labels", split_name)
+            if not os.path.exists(labels_path):
+                logger.warning(f"Labels path not found: {labels_path}")
+                continue
+
+            images_path = labels_path.replace("labels", "images", 1)
+            image_files = _list_images(images_path)
+
+            with os.scandir(labels_path) as it:
+                label_files = [entry.name for entry in it if entry.name.endswith('.txt')]
+
+            for file in label_files:
+                file_classes, boxes = parse_label_file(os.path.join(labels_path, file), self.classes_of_interest)
+                if not file_classes:
+                    continue
+                if classes is not None and not set(file_classes).intersection(classes):
+                    continue
+                image_path = os.path.join(images_path, image_files.get(os.path.splitext(file)[0], file))
+                yield image_path, os.path.join(labels_path, file), split_name, file_classes, boxes
+
+    def iter_samples(self, split: str | None = None, classes: list[int] | None = None,
+                     prefetch_images: bool = False, prefetch: int = 8):
+        """
+        Stream samples in the self.labels dict format.
+
+        Args:
+            split: only yield this split, defaults to all of splits_use
+            classes: only yield images containing at least one of these classes
+            prefetch_images: decode images on a background thread and add them as "image"
+                             (None if the image could not be read)
+            prefetch: maximum number of decoded images buffered ahead of the consumer
+        """
+        records = (self._make_record(*entry) for entry in self._iter_entries(split, classes))
+        if not prefetch_images:
+            yield from records
+            return
+
+        for record, image in _prefetch(records, lambda record: cv2.imread(record["image_path"]), prefetch):
+            record["image"] = image
+            yield record
+
+    def _iter_images(self, class_filter: list[int] | None = None):
+        """
+        Per-image label arrays, optionally only for images containing any of class_filter.
+
+        Yields:
+            (image_path, split, classes, boxes) with classes an int array and
+            boxes an (n, 4) array of normalised x_center, y_center, width, height
+        """
+        for image_path, _, split, classes, boxes in self._iter_entries(classes=class_filter):
+            yield (image_path, split, np.asarray(classes, dtype=np.int32),
+                   np.asarray(boxes, dtype=np.float64).reshape(-1, 4))
+
+    def crop_images(self, output_path: str, crop_filter: list[int], workers: int = 1): 
         logger.info(f"Starting image cropping. Output: {output_path}")
         logger.info(f"Crop filter classes: {crop_filter}")
         
@@ -156,114 +812,168 @@ class YOLODataset:
                     class_name = self.classes[class_idx]
                     os.makedirs(os.path.join(output_path, split, class_name), exist_ok=True)
         
-        total_crops = 0
-        filtered_labels = [label for label in self.labels 
-                          if len(label["available_classes"].intersection(crop_filter)) > 0]
-        
-        logger.info(f"Processing {len(filtered_labels)} images for cropping")
-        
-        for label in tqdm(filtered_labels, desc="Cropping images"):
-            output_path_image = os.path.join(output_path, label["split"])
-            count = 0
-
-            # Load original image once per file
-            original_image = cv2.imread(label["image_path"])
-            if original_image is None:
-                logger.warning(f"Could not load image: {label['image_path']}")
-                continue
-                
-            # Get dimensions from the loaded image
-            image_height, image_width = original_image.shape[:2]
-
-            for obj in label["labels"]:
-                if obj["obj_class"] in crop_filter:
-                    # De normalise the bounding box 
-                    try:
-                        x_center = obj["x_center"] * image_width
-                        y_center = obj["y_center"] * image_height
-                        width = obj["width"] * image_width
-                        height = obj["height"] * image_height
-    
-                        # Crop the image
-                        cropped_image = original_image[int(y_center - height / 2):int(y_center + height / 2), 
-                                      int(x_center - width / 2):int(x_center + width / 2)]
-    
-                        # Save the image
-                        class_name = self.classes[obj["obj_class"]]
-    
-                        # No need to create directory - already done
-                        class_output_dir = os.path.join(output_path_image, class_name)
-                        output_path_full = os.path.join(class_output_dir, os.path.basename(label['image_path']).replace(".", f"_{count}."))
-                        cv2.imwrite(output_path_full, cropped_image)   
-    
-                        count += 1
-                        total_crops += 1
-                    except:
-                        print("Error cropping images")
+        filtered_labels = self._iter_images(crop_filter)
+        total_images = None
+        if not self.lazy:
+            filtered_labels = list(filtered_labels)
+            total_images = len(filtered_labels)
+            logger.info(f"Processing {total_images} images for cropping")
+
+        # Each task decodes its image once and writes all of its crops, so with
+        # workers > 1 the images are spread over a process pool
+        tasks = ((image_path, split, classes, boxes, crop_filter, self.classes, output_path)
+                 for image_path, split, classes, boxes in filtered_labels)
+        start_time = time.perf_counter()
+        counts = list(tqdm(_pool_imap(_crop_image, tasks, workers, processes=True),
+                           total=total_images, desc="Cropping images"))
+        elapsed = time.perf_counter() - start_time
+
+        total_crops = sum(counts)
         logger.info(f"Cropping completed. Total crops saved: {total_crops}")
+        if elapsed > 0:
+            logger.info(f"Throughput: {len(counts) / elapsed:.1f} images/s, {total_crops / elapsed:.1f} crops/s "
+                        f"with {max(workers, 1)} worker(s)")
                         
     def remove_classes_inplace(self, remove_filter: list[int]): 
         logger.info(f"Starting class removal. Classes to remove: {remove_filter}")
         
         processed_images = 0
         total_removed = 0
-        
-        for label in tqdm(self.labels, desc="Removing classes"):
-            old_labels = label["labels"]
-            label["labels"] = [obj for obj in label["labels"] if obj["obj_class"] not in remove_filter]
 
-            label["available_classes"] = label["available_classes"].difference(remove_filter)
-
-            # Remove from image
-            to_remove = set(old_labels).difference(set(label["labels"])) 
-
-            if len(to_remove) == 0:
-                continue
-
-            image = cv2.imread(label["image_path"]) 
+        # Only images that contain a removed class need to be touched
+        to_process = self._iter_images(remove_filter)
+        
+        for image_path, split, classes, boxes in tqdm(to_process, desc="Removing classes"):
+            image = cv2.imread(image_path) 
             if image is None:
-                logger.warning(f"Could not load image: {label['image_path']}")
+                logger.warning(f"Could not load image: {image_path}")
                 continue
 
             image_height, image_width = image.shape[:2]
 
-            for obj in to_remove:
-                y_center = obj["y_center"] * image_height
-                x_center = obj["x_center"] * image_width
-                height = obj["height"] * image_height
-                width = obj["width"] * image_width
-
-                # Add bounds checking to prevent array out of bounds
-                y1 = max(0, int(y_center - height / 2))
-                y2 = min(image_height, int(y_center + height / 2))
-                x1 = max(0, int(x_center - width / 2))
-                x2 = min(image_width, int(x_center + width / 2))
-
-                image[y1:y2, x1:x2] = [0, 0, 0]
-                total_removed += 1
+            to_remove = denormalise_boxes(boxes[np.isin(classes, remove_filter)], image_width, image_height)
+            _black_out(image, to_remove)
+            total_removed += len(to_remove)
 
             # Remove redundant makedirs - the directory should already exist
-            cv2.imwrite(label["image_path"], image)
+            cv2.imwrite(image_path, image)
             processed_images += 1
+
+        # Drop the removed objects from the in-memory labels, nothing is held when lazy
+        if self.store is not None:
+            self.store = self.store.select_boxes(~self.store.box_mask(remove_filter), drop_empty=False)
+            self.labels = self.store.records()
+        else:
+            for label in self.labels:
+                label["labels"] = [obj for obj in label["labels"] if obj["obj_class"] not in remove_filter]
+                label["available_classes"] = label["available_classes"].difference(remove_filter)
         
         logger.info(f"Class removal completed. Processed {processed_images} images, removed {total_removed} objects")
 
-    def crop_using_model(self, model: YOLO, split: str, output_path: str, class_name: str):
+    def remove_classes(self, remove_filter: list[int], output_path: str, workers: int = 1) -> str:
+        """
+        Non-destructive remove_classes_inplace.
+
+        Writes a copy of the dataset to output_path in the same images/labels layout.
+        Images containing a removed class are blacked out and their label files
+        rewritten without those classes. Every other image and label file is
+        hardlinked (copied across filesystems), so treat the output as read-only.
+        Files are always unlinked before they are written, so re-running into the same
+        output never writes through a link into the source dataset.
+
+        Args:
+            remove_filter: class ids to black out and drop from the labels
+            output_path: root of the new dataset
+            workers: number of threads, cv2 decode/encode and the numpy fill release the GIL
+
+        Returns:
+            output_path
+        """
+        logger.info(f"Starting class removal into {output_path}. Classes to remove: {remove_filter}")
+
+        # Images that contain a removed class, keyed by split
+        to_process = {}
+        for image_path, label_path, split, classes, boxes in self._iter_entries(classes=remove_filter):
+            to_process.setdefault(split, []).append((image_path, label_path, classes, boxes))
+
+        tasks = []
+        links = []
+        for split in self.splits_use:
+            labels_path = os.path.join(self.path, "labels", split)
+            images_path = labels_path.replace("labels", "images", 1)
+            if not os.path.exists(labels_path):
+                logger.warning(f"Labels path not found: {labels_path}")
+                continue
+
+            output_images = os.path.join(output_path, "images", split)
+            output_labels = os.path.join(output_path, "labels", split)
+            os.makedirs(output_images, exist_ok=True)
+            os.makedirs(output_labels, exist_ok=True)
+
+            touched = set()
+            for image_path, label_path, classes, boxes in to_process.get(split, []):
+                output_image_path = os.path.join(output_images, os.path.basename(image_path))
+                output_label_path = os.path.join(output_labels, os.path.basename(label_path))
+                tasks.append((image_path, label_path, output_image_path, output_label_path,
+                              np.asarray(classes, dtype=np.int32), np.asarray(boxes, dtype=np.float64).reshape(-1, 4),
+                              remove_filter))
+                touched.update((image_path, label_path))
+
+            # Everything else, including images without any labels, is linked as is
+            for folder, output_folder in [(images_path, output_images), (labels_path, output_labels)]:
+                if not os.path.isdir(folder):
+                    continue
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        if entry.is_file() and entry.path not in touched:
+                            links.append((entry.path, os.path.join(output_folder, entry.name)))
+
+        logger.info(f"Blacking out {len(tasks)} images, linking {len(links)} untouched files")
+        removed = _pool_map(_remove_classes_image, tasks, workers, desc="Removing classes")
+        _pool_map(lambda link: link_or_copy(*link), links, workers, desc="Linking files")
+
+        logger.info(f"Class removal completed. Processed {len(tasks)} images, removed {sum(removed)} objects")
+        return output_path
+
+    def crop_using_model(self, model: YOLO, split: str, output_path: str, class_name: str) -> dict[str, int]:
+        """
+        Crop every detection of class_name straight into output_path.
+
+        Results are streamed one image at a time, so memory stays bounded and nothing
+        is written to the Ultralytics run directory. Crops use the same padding as
+        Ultralytics save_crop and are named <image folder>_<image stem>_<n>.jpg.
+
+        Returns:
+            number of detections per class name
+        """
         logger.info(f"Starting image cropping using model. Output: {output_path}") 
 
-        # os.makedirs(output_path, exist_ok=True)
+        os.makedirs(output_path, exist_ok=True)
 
         # Call the model.predict method
-        results = model.predict(self.path + "/images/**/*.*", save=True, save_crop=True) 
+        results = model.predict(self.path + "/images/**/*.*", stream=True, save=False, verbose=False) 
 
-        saved_dir = results[0].save_dir + "/crops/" + class_name
+        counts = {}
+        for result in tqdm(results, desc="Cropping using model"):
+            image_path = Path(result.path)
+            prefix = f"{image_path.parent.name}_{image_path.stem}"
+            count = 0
 
-        # Copy entire saved directory to output path 
-        shutil.copytree(saved_dir, output_path)
+            for box in result.boxes:
+                name = result.names[int(box.cls)]
+                counts[name] = counts.get(name, 0) + 1
+                if name != class_name:
+                    continue
 
-        logger.info(f"Image cropping completed. Total crops saved: {len(os.listdir(output_path))}")
+                crop = save_one_box(box.xyxy, result.orig_img, BGR=True, save=False)
+                cv2.imwrite(os.path.join(output_path, f"{prefix}_{count}.jpg"), crop)
+                count += 1
 
-    def crop_bus_with_number(self, output_path: str, bus_index: int, number_indices: list[int]):
+        logger.info(f"Detections per class: {counts}")
+        logger.info(f"Image cropping completed. Total crops saved: {counts.get(class_name, 0)}")
+        return counts
+
+    def crop_bus_with_number(self, output_path: str, bus_index: int, number_indices: list[int], workers: int = 1):
         # Init dataset at output path
         os.makedirs(output_path, exist_ok=True)
         os.makedirs(os.path.join(output_path, "images"), exist_ok=True)
@@ -273,103 +983,28 @@ class YOLODataset:
         os.makedirs(os.path.join(output_path, "labels", "train"), exist_ok=True)
         os.makedirs(os.path.join(output_path, "labels", "valid"), exist_ok=True)
 
-        # Loop thru labels
-        for label in tqdm(self.labels, desc="Cropping bus with number"):
-            split = label["split"] 
-            print(split)
-
-            if not bus_index in label["available_classes"]:
-                continue
+        # Each task decodes one image once and crops all of its buses, with
+        # workers > 1 the images are spread over a process pool
+        tasks = ((image_path, split, classes, boxes, bus_index, number_indices, output_path)
+                 for image_path, split, classes, boxes in self._iter_images([bus_index]))
+        bus_counts = list(tqdm(_pool_imap(_crop_bus_with_number_image, tasks, workers, processes=True),
+                               desc="Cropping bus with number"))
+        logger.info(f"Saved {sum(bus_counts)} bus crops from {len(bus_counts)} images")
 
-            image_labels = label["labels"] 
-
-            # Get labels with bus index
-            bus_labels = [obj for obj in image_labels if obj["obj_class"] == bus_index]
-
-            # Get labels with number indices
-            number_labels = [obj for obj in image_labels if obj["obj_class"] in number_indices]
-            
-            # Loop thru bus labels
-            for index, bus_label in enumerate(bus_labels):
-
-                bus_crop_output_path = os.path.join(output_path, "images", split, f"{os.path.basename(label['image_path'])}_{index}.jpg")
-                bus_crop_output_label_path = os.path.join(output_path, "labels", split, f"{os.path.basename(label['image_path'])}_{index}.txt")
-
-                # Get bus image
-                bus_image = cv2.imread(label["image_path"])
-                bus_image_height, bus_image_width = bus_image.shape[:2]
-
-                # Get bus bounding box
-                x_center = bus_label["x_center"] * bus_image_width
-                y_center = bus_label["y_center"] * bus_image_height
-                width = bus_label["width"] * bus_image_width
-                height = bus_label["height"] * bus_image_height
-
-                bus_x1 = int(x_center - width / 2)
-                bus_x2 = int(x_center + width / 2)
-                bus_y1 = int(y_center - height / 2)
-                bus_y2 = int(y_center + height / 2)
-
-                # Crop bus image
-                bus_crop = bus_image[bus_y1:bus_y2, bus_x1:bus_x2]
-
-                bus_width = bus_x2 - bus_x1
-                bus_height = bus_y2 - bus_y1
-
-                # Loop thru number labels and get labels within the bus bounding box
-                matching_number_labels = []
-                for number_label in number_labels:
-                    number_x_center = number_label["x_center"] * bus_image_width
-                    number_y_center = number_label["y_center"] * bus_image_height
-                    number_width = number_label["width"] * bus_image_width
-                    number_height = number_label["height"] * bus_image_height 
-
-                    number_x1 = number_x_center - number_width / 2
-                    number_x2 = number_x_center + number_width / 2
-                    number_y1 = number_y_center - number_height / 2
-                    number_y2 = number_y_center + number_height / 2
-
-                    # Check if number label is within bus bounding box
-                    # If it is, normalise the label to the bus crop
-                    if number_x1 > bus_x1 and number_x2 < bus_x2 and number_y1 > bus_y1 and number_y2 < bus_y2:
-                        # Normalise the label to the bus crop
-                        number_label["x_center"] = (number_x_center - bus_x1) / bus_width
-                        number_label["y_center"] = (number_y_center - bus_y1) / bus_height
-                        number_label["width"] = number_width / bus_width
-                        number_label["height"] = number_height / bus_height
-                        
-                        # Save the label
-                        matching_number_labels.append(number_label) 
-
-                # Save the bus crop
-                try:
-                    cv2.imwrite(bus_crop_output_path, bus_crop)
-                except:
-                    print("Error saving bus crop")
-                    continue
+        return output_path
 
-                # Save the labels
-                with open(bus_crop_output_label_path, "w") as f:
-                    for number_label in matching_number_labels:
-                        f.write(f"{number_label['obj_class']} {number_label['x_center']} {number_label['y_center']} {number_label['width']} {number_label['height']}\n")
-
-                # save a copy of bus crop for label-less background
-                bus_crop_no_labels = bus_crop.copy()
-                # loop thru each label and set area to black
-                for number_label in matching_number_labels:
-                    # de-normalise the label to the bus crop
-                    number_x_center = number_label["x_center"] * bus_width
-                    number_y_center = number_label["y_center"] * bus_height
-                    number_width = number_label["width"] * bus_width
-                    number_height = number_label["height"] * bus_height
-
-                    bus_crop_no_labels[int(number_y_center - number_height / 2):int(number_y_center + number_height / 2), int(number_x_center - number_width / 2):int(number_x_center + number_width / 2)] = 0
-                bus_crop_output_path_no_labels = os.path.join(output_path, "images", split, f"{os.path.basename(label['image_path'])}_{index}_no_labels.jpg")
-                cv2.imwrite(bus_crop_output_path_no_labels, bus_crop_no_labels)
+    def crop_bus_with_number_using_model(self, output_path: str, model: YOLO, number_indices: list[int],
+                                         batch_size: int = 16, prefetch_batches: int = 2):
+        """
+        Crop buses found by the model and keep the labelled numbers inside them.
 
-        return output_path
+        Images are decoded on a background thread and fed to the model in batches.
+        Ultralytics saving is turned off, only the crops and remapped labels are written.
 
-    def crop_bus_with_number_using_model(self, output_path: str, model: YOLO, number_indices: list[int]):
+        Args:
+            batch_size: number of images per model.predict call
+            prefetch_batches: number of decoded batches buffered ahead of the model
+        """
         # Init dataset at output path
         os.makedirs(output_path, exist_ok=True)
         os.makedirs(os.path.join(output_path, "images"), exist_ok=True)
@@ -379,67 +1014,43 @@ class YOLODataset:
         os.makedirs(os.path.join(output_path, "labels", "train"), exist_ok=True)
         os.makedirs(os.path.join(output_path, "labels", "valid"), exist_ok=True)
 
-        # Loop thru labels
-        for label in tqdm(self.labels, desc="Cropping bus with number using model"):
-            split = label["split"]
-
-            # Find the bus using the model
-            image = cv2.imread(label["image_path"])
-            bus_image_height, bus_image_width = image.shape[:2]
-            results = model.predict(image, save=True, save_crop=True)
-            
-
-            # Get the bus crop
-            bus_coords = results[0].boxes.xyxy 
-            for index, coord in enumerate(bus_coords):
-                x1 = int(coord[0])
-                y1 = int(coord[1])
-                x2 = int(coord[2])
-                y2 = int(coord[3])
-
-                bus_crop_output_path = os.path.join(output_path, "images", split, f"{os.path.basename(label['image_path'])}_{index}.jpg")
-                bus_crop_output_label_path = os.path.join(output_path, "labels", split, f"{os.path.basename(label['image_path'])}_{index}.txt")
-
-                # Crop the bus
-                bus_crop = image[y1:y2, x1:x2]
-
-                bus_crop_height, bus_crop_width = bus_crop.shape[:2]
-
-                # Get the number labels
-                number_labels = [obj for obj in label["labels"] if obj["obj_class"] in number_indices]
-
-                # Loop thru number labels
-                matching_number_labels = []
-                for number_label in number_labels:
-                    # Get the number label
-                    number_x_center = number_label["x_center"] * bus_image_width
-                    number_y_center = number_label["y_center"] * bus_image_height
-                    number_width = number_label["width"] * bus_image_width
-                    number_height = number_label["height"] * bus_image_height
-
-                    number_x1 = number_x_center - number_width / 2
-                    number_x2 = number_x_center + number_width / 2
-                    number_y1 = number_y_center - number_height / 2
-                    number_y2 = number_y_center + number_height / 2
-
-                    # Check if number label is within bus bounding box  
-                    if number_x1 > x1 and number_x2 < x2 and number_y1 > y1 and number_y2 < y2:
-                        # Normalise the label to the bus crop
-                        number_label["x_center"] = (number_x_center - x1) / bus_crop_width
-                        number_label["y_center"] = (number_y_center - y1) / bus_crop_height
-                        number_label["width"] = number_width / bus_crop_width
-                        number_label["height"] = number_height / bus_crop_height
-                        
-                        # Save the label
-                        matching_number_labels.append(number_label)
-
-                # Save the bus crop
-                cv2.imwrite(bus_crop_output_path, bus_crop)
-
-                # Save the labels
-                with open(bus_crop_output_label_path, "w") as f:
-                    for number_label in matching_number_labels:
-                        f.write(f"{number_label['obj_class']} {number_label['x_center']} {number_label['y_center']} {number_label['width']} {number_label['height']}\n")
-                
-                
-            
\ No newline at end of file
+        decoded = _prefetch(self._iter_images(), lambda sample: cv2.imread(sample[0]), batch_size * prefetch_batches)
+        progress = tqdm(desc="Cropping bus with number using model", total=None if self.lazy else len(self.labels))
+        total_buses = 0
+
+        for batch in _batched(decoded, batch_size):
+            progress.update(len(batch))
+            batch = [(sample, image) for sample, image in batch if image is not None]
+            if not batch:
+                continue
+
+            # Find the buses using the model
+            results = model.predict([image for _, image in batch], save=False, verbose=False)
+
+            for ((image_path, split, classes, boxes), image), result in zip(batch, results):
+                image_height, image_width = image.shape[:2]
+                bus_boxes = result.boxes.xyxy.cpu().numpy().astype(int)
+
+                # Get the number labels in pixels
+                scale = np.array([image_width, image_height], dtype=np.float64)
+                is_number = np.isin(classes, number_indices)
+                number_classes = classes[is_number]
+                number_centers = boxes[is_number, :2].astype(np.float64) * scale
+                number_sizes = boxes[is_number, 2:].astype(np.float64) * scale
+
+                # Numbers within each detected bus, for all buses at once
+                inside = _contained(bus_boxes, np.concatenate([number_centers - number_sizes / 2, number_centers + number_sizes / 2], axis=1))
+
+                name = os.path.basename(image_path)
+                for index, bus_box in enumerate(bus_boxes.tolist()):
+                    matched = inside[index]
+                    _write_bus_crop(
+                        image, bus_box, number_classes[matched], number_centers[matched], number_sizes[matched],
+                        os.path.join(output_path, "images", split, f"{name}_{index}.jpg"),
+                        os.path.join(output_path, "labels", split, f"{name}_{index}.txt"),
+                    )
+                total_buses += len(bus_boxes)
+
+        progress.close()
+        logger.info(f"Saved {total_buses} bus crops")
+        return output_path
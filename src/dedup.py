@@ -0,0 +1,179 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import yaml
+from tqdm import tqdm
+
+from .image_index import list_images
+
+"""
+
+Perceptual hash deduplication
+
+Run after merge_yolo_datasets to drop duplicate and near-duplicate frames:
+- every image gets a 64-bit DCT perceptual hash (computed on a thread pool)
+- images are visited in order and looked up in a BK-tree of the images kept so far
+- an image within max_distance bits of a kept image is a duplicate, otherwise it is kept
+
+The kept images are written to a manifest (one absolute image path per line),
+which Ultralytics accepts in place of an image folder in the data YAML.
+
+"""
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def phash(image_path: str) -> int | None:
+    """64-bit DCT perceptual hash of an image, None if it cannot be read."""
+    # The JPEG decoder downscales while decoding, the hash only needs 32x32 pixels
+    image = cv2.imread(image_path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if image is None:
+        return None
+    small = cv2.resize(image, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    # Compare against the median of the low frequencies, leaving out the DC term
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def compute_phashes(image_paths: list[str], workers: int = 8) -> list[int | None]:
+    """Perceptual hashes of many images, cv2 releases the GIL so a thread pool uses all cores."""
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return list(tqdm(pool.map(phash, image_paths), total=len(image_paths), desc="Hashing images"))
+
+
+class BKTree:
+    """BK-tree over 64-bit hashes with Hamming distance, for radius queries without all-pairs comparison."""
+
+    def __init__(self):
+        # Nodes are (hash, item, {distance: child})
+        self.root = None
+        self.size = 0
+
+    def add(self, value: int, item) -> None:
+        self.size += 1
+        if self.root is None:
+            self.root = (value, item, {})
+            return
+        node = self.root
+        while True:
+            distance = (node[0] ^ value).bit_count()
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, item, {})
+                return
+            node = child
+
+    def search(self, value: int, radius: int) -> list[tuple[int, object]]:
+        """All (distance, item) pairs within radius bits of value."""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node_value, item, children = stack.pop()
+            distance = (node_value ^ value).bit_count()
+            if distance <= radius:
+                found.append((distance, item))
+            # Triangle inequality: only children in [distance - radius, distance + radius] can match
+            for child_distance, child in children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+# Priority of the usual split names when splits are discovered, anything else follows alphabetically
+SPLIT_PRIORITY = ["train", "val", "valid", "test"]
+
+
+def dataset_splits(dataset_path: str) -> list[str]:
+    """Split folders under <dataset_path>/images in deduplication priority order (train first)."""
+    images_path = os.path.join(dataset_path, "images")
+    if not os.path.isdir(images_path):
+        return []
+    splits = [entry.name for entry in os.scandir(images_path) if entry.is_dir()]
+    return sorted(splits, key=lambda split: (SPLIT_PRIORITY.index(split) if split in SPLIT_PRIORITY else len(SPLIT_PRIORITY), split))
+
+
+def dedup_yolo_dataset(dataset_path: str, splits=["train", "val"], max_distance: int = 4, workers: int = 8) -> dict[str, str]:
+    """
+    Write a deduplicated image manifest per split of a YOLO dataset.
+
+    Splits share one index and are processed in order, so an image in a later split
+    that duplicates an earlier one (e.g. val against train) is dropped as well.
+
+    Args:
+        dataset_path: root of the dataset with images/<split> folders
+        splits: splits to deduplicate, in priority order. None for every split folder
+                of the dataset (see dataset_splits)
+        max_distance: maximum Hamming distance between hashes of near-duplicates
+        workers: number of hashing threads
+
+    Returns:
+        Dict of split to manifest path (<dataset_path>/<split>_dedup.txt)
+    """
+    logger.info(f"Starting deduplication of {dataset_path}, max distance {max_distance}")
+
+    if splits is None:
+        splits = dataset_splits(dataset_path)
+        logger.info(f"Deduplicating splits: {splits}")
+
+    tree = BKTree()
+    manifests = {}
+    for split in splits:
+        images_path = os.path.join(dataset_path, "images", split)
+        if not os.path.exists(images_path):
+            logger.warning(f"Missing {split} split in {dataset_path}")
+            continue
+
+        image_paths = list_images(images_path)
+        hashes = compute_phashes(image_paths, workers)
+
+        kept = []
+        duplicates = 0
+        unreadable = 0
+        for image_path, value in zip(image_paths, hashes):
+            if value is None:
+                unreadable += 1
+                continue
+            if tree.search(value, max_distance):
+                duplicates += 1
+                continue
+            tree.add(value, image_path)
+            kept.append(image_path)
+
+        manifest_path = os.path.join(dataset_path, f"{split}_dedup.txt")
+        with open(manifest_path, "w") as f:
+            f.writelines(f"{image_path}\n" for image_path in kept)
+        manifests[split] = manifest_path
+
+        logger.info(f"{split}: kept {len(kept)} of {len(image_paths)} images, "
+                    f"dropped {duplicates} duplicates and {unreadable} unreadable images")
+
+    return manifests
+
+
+def write_dedup_data_yaml(data_yaml: str, manifests: dict[str, str], output_yaml: str) -> str:
+    """
+    Copy a data YAML with every split folder that has a manifest replaced by that manifest.
+
+    Entries like 'train: images/train' are matched against the split names in manifests.
+    """
+    with open(data_yaml, "r") as f:
+        data = yaml.safe_load(f)
+
+    for key in ["train", "val", "test"]:
+        value = data.get(key)
+        if not isinstance(value, str):
+            continue
+        split = os.path.basename(os.path.normpath(value))
+        if split in manifests:
+            data[key] = os.path.abspath(manifests[split])
+
+    with open(output_yaml, "w") as f:
+        yaml.dump(data, f, default_flow_style=False, sort_keys=False)
+    logger.info(f"Deduplicated data YAML saved to: {output_yaml}")
+    return output_yaml
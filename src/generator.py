@@ -0,0 +1,471 @@
+from typing import List, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import threading
+import numpy as np
+import os
+import logging
+import cv2
+
+# Types for type hinting [x,y]
+Coordinates = Tuple[int, int]
+PartPlacement = Tuple[Coordinates, Coordinates, int]  # (top_left, bottom_right, class)
+
+
+# Occupancy of one generated image, used to find free space for the next part
+class PlacementGrid:
+    """
+    Occupancy mask of the placement perimeter with an integral image on top.
+
+    The covered area of any window is four lookups in the integral image, so a
+    random candidate position is checked in O(1). When candidates keep failing
+    (crowded scenes) all valid top-left positions are computed at once and one is
+    drawn from them, so a part is only dropped when it really does not fit.
+
+    The overlap limit holds both ways: a new part may not be covered by more than
+    max_overlap of its area, and it may not cover more than max_overlap of any part
+    placed before it, so a large part never hides a small labelled one.
+    """
+
+    def __init__(
+        self,
+        background_size: Coordinates,
+        max_overlap: float = 0.0,
+        perimeter_start: Tuple[int, int] = (0, 0),
+        perimeter_end: Tuple[int, int] = (2560, 1440),
+        rng: Optional[np.random.Generator] = None,
+        attempts: int = 16,
+    ) -> None:
+        # background_size is (height, width), perimeters are (x, y)
+        self.start_x, self.start_y = max(0, perimeter_start[0]), max(0, perimeter_start[1])
+        self.end_x = min(background_size[1], perimeter_end[0])
+        self.end_y = min(background_size[0], perimeter_end[1])
+        self.max_overlap = max_overlap
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.attempts = attempts
+
+        self.mask = np.zeros((max(0, self.end_y - self.start_y), max(0, self.end_x - self.start_x)), dtype=np.uint8)
+        self._integral = None
+
+        # Placed parts as x1, y1, x2, y2 relative to the perimeter
+        self.boxes = np.zeros((0, 4), dtype=np.int64)
+
+    @property
+    def integral(self) -> np.ndarray:
+        if self._integral is None:
+            self._integral = cv2.integral(self.mask)
+        return self._integral
+
+    def covered(self, x: int, y: int, width: int, height: int) -> int:
+        """Number of occupied pixels in the window, x and y relative to the perimeter."""
+        integral = self.integral
+        return int(
+            integral[y + height, x + width] - integral[y, x + width]
+            - integral[y + height, x] + integral[y, x]
+        )
+
+    def sample(self, part_size: Coordinates) -> Optional[Coordinates]:
+        """Random top-left (x, y) where the part fits within the allowed overlap, None if none exists."""
+        part_height, part_width = part_size
+        free_height = self.mask.shape[0] - part_height + 1
+        free_width = self.mask.shape[1] - part_width + 1
+        if free_height <= 0 or free_width <= 0:
+            raise ValueError("Perimeter is too small to fit the part.")
+
+        limit = self.max_overlap * part_height * part_width
+        x1, y1, x2, y2 = self.boxes.T
+        placed_limits = self.max_overlap * (x2 - x1) * (y2 - y1)
+
+        # Cheap rejection sampling first, uniform over the valid positions like the fallback
+        for _ in range(self.attempts):
+            x = int(self.rng.integers(free_width))
+            y = int(self.rng.integers(free_height))
+            if self.covered(x, y, part_width, part_height) > limit:
+                continue
+            overlap_x = np.clip(np.minimum(x2, x + part_width) - np.maximum(x1, x), 0, None)
+            overlap_y = np.clip(np.minimum(y2, y + part_height) - np.maximum(y1, y), 0, None)
+            if np.all(overlap_x * overlap_y <= placed_limits):
+                return x + self.start_x, y + self.start_y
+
+        # Covered area of every window at once
+        integral = self.integral
+        covered = (
+            integral[part_height:, part_width:] - integral[:free_height, part_width:]
+            - integral[part_height:, :free_width] + integral[:free_height, :free_width]
+        )
+        allowed = covered <= limit
+
+        # Share of every placed part each window would cover, separable in x and y
+        xs, ys = np.arange(free_width), np.arange(free_height)
+        for box_x1, box_y1, box_x2, box_y2, placed_limit in zip(x1, y1, x2, y2, placed_limits):
+            overlap_x = np.clip(np.minimum(box_x2, xs + part_width) - np.maximum(box_x1, xs), 0, None)
+            overlap_y = np.clip(np.minimum(box_y2, ys + part_height) - np.maximum(box_y1, ys), 0, None)
+            allowed &= np.outer(overlap_y, overlap_x) <= placed_limit
+
+        valid = np.flatnonzero(allowed)
+        if len(valid) == 0:
+            return None
+        y, x = divmod(int(valid[self.rng.integers(len(valid))]), free_width)
+        return x + self.start_x, y + self.start_y
+
+    def occupy(self, top_left: Coordinates, bottom_right: Coordinates) -> None:
+        x1 = max(top_left[0] - self.start_x, 0)
+        y1 = max(top_left[1] - self.start_y, 0)
+        x2 = min(bottom_right[0] - self.start_x, self.mask.shape[1])
+        y2 = min(bottom_right[1] - self.start_y, self.mask.shape[0])
+        if x2 > x1 and y2 > y1:
+            self.mask[y1:y2, x1:x2] = 1
+            self._integral = None
+            self.boxes = np.vstack([self.boxes, [[x1, y1, x2, y2]]])
+
+
+def _blend(destination: np.ndarray, part: np.ndarray, alpha: np.ndarray) -> np.ndarray:
+    """uint16 fixed-point (alpha * part + (255 - alpha) * destination) / 255, rounded to nearest."""
+    alpha = alpha[..., np.newaxis].astype(np.uint16)
+    blended = np.multiply(part, alpha, dtype=np.uint16)
+    np.subtract(255, alpha, out=alpha)
+    blended += np.multiply(destination, alpha, dtype=np.uint16)
+
+    # x / 255 rounded for 0 <= x <= 255 * 255: (x + 128 + ((x + 128) >> 8)) >> 8
+    blended += 128
+    blended += blended >> 8
+    blended >>= 8
+    return blended
+
+
+def composite(destination: np.ndarray, part: np.ndarray) -> None:
+    """
+    Blend a BGR or BGRA uint8 part into an equally sized uint8 BGR destination, in place.
+
+    Opaque parts (no alpha channel, or alpha 255 everywhere) are a plain copy. For
+    other BGRA parts opaque pixels are copied and only pixels with partial alpha
+    are blended, in uint16 fixed point rounded exactly as float math would round.
+    """
+    if part.shape[2] != 4:
+        destination[...] = part
+        return
+
+    # Contiguous colour and alpha planes, numpy is slow on the interleaved BGRA views
+    colour = cv2.cvtColor(part, cv2.COLOR_BGRA2BGR)
+    alpha = cv2.extractChannel(part, 3)
+    if alpha.min() == 255:
+        destination[...] = colour
+        return
+
+    partial = cv2.inRange(alpha, 1, 254)
+    if cv2.countNonZero(partial) * 4 >= partial.size:
+        # Blending is exact for alpha 0 and 255 too, so dense alpha blends everything
+        destination[...] = _blend(destination, colour, alpha)
+        return
+
+    # Cut-out parts only have partial alpha along their edges, copy the opaque
+    # pixels and blend just the edge pixels
+    opaque = (alpha == 255).view(np.uint8)
+    if destination.strides[1:] == (3, 1):
+        # Row strided region of a BGR image, OpenCV writes into it directly
+        cv2.copyTo(colour, opaque, destination)
+    else:
+        np.copyto(destination, colour, where=opaque.astype(bool)[:, :, np.newaxis])
+    points = cv2.findNonZero(partial)
+    if points is None:
+        return
+    xs, ys = points.reshape(-1, 2).T
+    destination[ys, xs] = _blend(destination[ys, xs], colour[ys, xs], alpha[ys, xs])
+
+
+# Generic Class for all generators
+class Generator:
+    def __init__(self) -> None:
+        pass
+
+    # Any generator must implement the generate method to be used by stitcher
+    def generate(
+        self,
+        background: np.ndarray,
+        parts: List[np.ndarray],
+        image_dir: str,
+        label_dir: str,
+        image_name: str,
+    ) -> List[np.ndarray]:
+        raise NotImplementedError("Use a particular generator class")
+
+
+# YOLOv8 Generator
+class YOLOv8Generator(Generator):
+    def __init__(self, overlap_ratio=0.1, seed: Optional[int] = None, writers: int = 0,
+                 max_pending: Optional[int] = None, jpeg_quality: int = 95) -> None:
+        """
+        Args:
+            overlap_ratio: maximum share of a new part's area that may already be
+                           covered by parts placed before it
+            seed: seed of the part placement
+            writers: number of background threads that encode and write the samples,
+                     0 writes them synchronously inside generate
+            max_pending: composed samples waiting for a writer before generate blocks,
+                         defaults to 4 per writer. Bounds the memory held by the queue
+            jpeg_quality: JPEG quality of the written images
+        """
+        super().__init__()
+        self.overlap_ratio = overlap_ratio
+        self.rng = np.random.default_rng(seed)
+        self.jpeg_quality = jpeg_quality
+
+        # Samples that could not be written, both files are removed for each of them
+        self.failed: List[str] = []
+        self._failed_lock = threading.Lock()
+
+        self._pool = None
+        if writers > 0:
+            self._pool = ThreadPoolExecutor(max_workers=writers, thread_name_prefix="generator-writer")
+            self._slots = threading.BoundedSemaphore(max_pending or writers * 4)
+            # Futures whose _write_done has not finished yet, flush waits for it to drain
+            self._pending = set()
+            self._pending_lock = threading.Condition()
+
+    def generate(
+        self,
+        background: np.ndarray,
+        parts: List[np.ndarray],
+        classes: List[int],
+        output_dir: str,
+        image_name: str,
+        train_or_val: bool,  # True for train, False for val
+        perimeter_start: Tuple[int, int] = (0, 0),
+        perimeter_end: Tuple[int, int] = (2560, 1440)
+    ) -> bool:  # Return indicates success or failure
+        # With writers, True means the sample was queued. Write failures are
+        # collected in self.failed and reported by flush() and close()
+
+        # join the image dir, train/val, and image name
+        if train_or_val:
+            image_dir = os.path.join(output_dir, "images", "train")
+            label_dir = os.path.join(output_dir, "labels", "train")
+        else:
+            image_dir = os.path.join(output_dir, "images", "val")
+            label_dir = os.path.join(output_dir, "labels", "val")
+
+        os.makedirs(image_dir, exist_ok=True)
+        os.makedirs(label_dir, exist_ok=True)
+
+        if len(parts) == 0 or len(classes) == 0 or len(parts) != len(classes):
+            logging.error("Invalid parts or classes")
+            return False
+
+        image, current_positions = self.compose(background, parts, classes, perimeter_start, perimeter_end)
+        image_path = os.path.join(image_dir, image_name + ".jpg")
+        label_path = os.path.join(label_dir, image_name + ".txt")
+
+        if self._pool is None:
+            return self._write_sample(image, current_positions, image_path, label_path)
+
+        # Blocks while max_pending samples are waiting, so composition never runs far ahead of the disk
+        self._slots.acquire()
+        try:
+            future = self._pool.submit(self._write_sample, image, current_positions, image_path, label_path)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._pending_lock:
+            self._pending.add(future)
+        future.add_done_callback(partial(self._write_done, image_path, label_path))
+        return True
+
+    def compose(
+        self,
+        background: np.ndarray,
+        parts: List[np.ndarray],
+        classes: List[int],
+        perimeter_start: Tuple[int, int] = (0, 0),
+        perimeter_end: Tuple[int, int] = (2560, 1440)
+    ) -> Tuple[np.ndarray, List[PartPlacement]]:
+        """
+        Place the parts on a copy of the background without touching the disk.
+
+        Returns:
+            The composed BGR image and the placement (top_left, bottom_right, class) of every placed part
+        """
+        current_positions = []  # Array to hold all current part positions
+        background_copy = background.copy()
+        grid = PlacementGrid(
+            background_copy.shape[:2], self.overlap_ratio, perimeter_start=perimeter_start, perimeter_end=perimeter_end, rng=self.rng
+        )
+        for part, class_id in zip(parts, classes):
+            try:
+                part_size = part.shape[:2]
+                new_position = self._get_new_part_position(grid, part_size)
+
+                if new_position is None:
+                    continue
+
+                new_position = new_position + (class_id,)
+
+                current_positions.append(new_position)
+                background_copy = self._place_part(background_copy, part, new_position)
+            except:
+                print("error placing part")
+        return background_copy[:, :, :3], current_positions
+
+    def flush(self) -> int:
+        """
+        Wait until every queued sample is written.
+
+        Returns:
+            Number of samples that failed to write so far, listed in self.failed
+        """
+        if self._pool is not None:
+            # Waits for the done callbacks rather than the futures, failures are recorded there
+            with self._pending_lock:
+                self._pending_lock.wait_for(lambda: not self._pending)
+        with self._failed_lock:
+            return len(self.failed)
+
+    def close(self) -> int:
+        """Flush and stop the writer threads, generate writes synchronously afterwards."""
+        failed = self.flush()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        if failed:
+            logging.error(f"{failed} generated samples could not be written")
+        return failed
+
+    def __enter__(self) -> "YOLOv8Generator":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _write_done(self, image_path: str, label_path: str, future) -> None:
+        if future.exception() is not None:
+            # Escaped _write_sample, so neither file can be trusted
+            logging.error(f"Error writing generated sample {image_path}: {future.exception()}")
+            self._remove_sample(image_path, label_path)
+            with self._failed_lock:
+                self.failed.append(image_path)
+        self._slots.release()
+        with self._pending_lock:
+            self._pending.discard(future)
+            self._pending_lock.notify_all()
+
+    @staticmethod
+    def _remove_sample(image_path: str, label_path: str) -> None:
+        for path in (image_path, label_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _write_sample(
+        self,
+        image: np.ndarray,
+        current_positions: List[PartPlacement],
+        image_path: str,
+        label_path: str,
+    ) -> bool:
+        """Encode and write one image and its labels, removing both if either fails."""
+        success = self._save_image(image, image_path)
+        if not success:
+            logging.error(f"Error saving image {image_path}")
+        else:
+            background_size = (image.shape[1], image.shape[0])
+            success = self._save_labels(current_positions, label_path, background_size)
+            if not success:
+                logging.error(f"Error saving labels {label_path}")
+
+        if not success:
+            # Never leave an image without its labels or stale labels of an older image
+            self._remove_sample(image_path, label_path)
+            with self._failed_lock:
+                self.failed.append(image_path)
+        return success
+
+    def _get_new_part_position(
+        self,
+        grid: PlacementGrid,
+        part_size: Coordinates,
+    ) -> Optional[Tuple[Coordinates, Coordinates]]:
+        # x,y refers to the top left coordinate of the part, not center
+        top_left = grid.sample(part_size)
+        if top_left is None:
+            return None
+
+        # Coordinates of the new part (top-left and bottom-right)
+        new_x1, new_y1 = top_left
+        new_x2, new_y2 = new_x1 + part_size[1], new_y1 + part_size[0]
+        grid.occupy((new_x1, new_y1), (new_x2, new_y2))
+        return (new_x1, new_y1), (new_x2, new_y2)
+
+    def _place_part(
+        self, background: np.ndarray, part: np.ndarray, position: PartPlacement
+    ) -> np.ndarray:
+        background = background[:, :, :3]  # Remove the alpha channel if it exists
+        background_width, background_height = background.shape[1], background.shape[0]
+
+        # Get the coordinates to place part
+        x1, y1 = position[0]  # Rmb these are the top left coordinates
+        x2, y2 = position[1]
+
+        x1_clamped = max(x1, 0)
+        x2_clamped = min(x2, background_width)
+        y1_clamped = max(y1, 0)
+        y2_clamped = min(y2, background_height)
+        if x2_clamped <= x1_clamped or y2_clamped <= y1_clamped:
+            return background
+
+        # Background and part at the coords, the part is cut by the same amount as the clamping
+        bg_slice = background[y1_clamped:y2_clamped, x1_clamped:x2_clamped, :]
+        part_slice = part[
+            y1_clamped - y1 : y2_clamped - y1, x1_clamped - x1 : x2_clamped - x1
+        ]
+
+        # Written into the background slice in place
+        composite(bg_slice, part_slice)
+        return background
+
+    def _save_labels(
+        self,
+        current_positions: List[Coordinates],
+        output_path: str,
+        background_size: Coordinates,
+    ) -> bool:
+        # need to convert x1,y1,x2,y2 to x_center, y_center, width, height for YOLO
+        # need to normalize the values by dividing by the background size
+        to_write = ""
+        for position in current_positions:
+            x1, y1 = position[0]
+            x2, y2 = position[1]
+            class_id = position[2]
+
+            if class_id == -1:
+                continue
+
+            x_center = (x1 + x2) / 2 / background_size[0]
+            y_center = (y1 + y2) / 2 / background_size[1]
+            width = (x2 - x1) / background_size[0]
+            height = (y2 - y1) / background_size[1]
+
+            to_write += f"{class_id} {x_center} {y_center} {width} {height}\n"
+
+        try:
+            with open(output_path, "w") as f:
+                f.write(to_write)
+            return True
+        except Exception as e:
+            logging.error(f"Error saving labels: {e}")
+            return False
+
+    def _save_image(self, image: np.ndarray, output_path: str) -> bool:
+        try:
+            # Encode in memory, cv2.imwrite does not report why a write failed
+            success, encoded = cv2.imencode(
+                os.path.splitext(output_path)[1], image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+            )
+            if not success:
+                logging.error(f"Error encoding image {output_path}")
+                return False
+            with open(output_path, "wb") as f:
+                f.write(encoded.data)
+            return True
+        except Exception as e:
+            logging.error(f"Error saving image: {e}")
+            return False
\ No newline at end of file
@@ -0,0 +1,144 @@
+import os
+import struct
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+"""
+
+Image dimension index
+
+Reads image width and height from the file header only (JPEG, PNG, BMP),
+without decoding any pixels. JPEG EXIF orientation is honoured so the sizes
+match what cv2.imread returns.
+
+"""
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp']
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# SOF markers carry the frame size, C4 (DHT), C8 (JPG) and CC (DAC) do not
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def _exif_orientation(segment: bytes) -> int:
+    """Orientation tag of an APP1 Exif segment, 1 when absent or unreadable."""
+    if not segment.startswith(b"Exif\x00\x00"):
+        return 1
+    tiff = segment[6:]
+    if len(tiff) < 8 or tiff[:2] not in (b"II", b"MM"):
+        return 1
+    endian = "<" if tiff[:2] == b"II" else ">"
+    ifd_offset = struct.unpack(endian + "I", tiff[4:8])[0]
+    if ifd_offset + 2 > len(tiff):
+        return 1
+    entries = struct.unpack(endian + "H", tiff[ifd_offset:ifd_offset + 2])[0]
+    for i in range(entries):
+        start = ifd_offset + 2 + i * 12
+        if start + 12 > len(tiff):
+            break
+        tag = struct.unpack(endian + "H", tiff[start:start + 2])[0]
+        if tag == 0x0112:
+            return struct.unpack(endian + "H", tiff[start + 8:start + 10])[0]
+    return 1
+
+
+def _jpeg_size(f) -> tuple[int, int] | None:
+    orientation = 1
+    f.seek(2)
+    while True:
+        # Markers are 0xFF followed by a code, extra 0xFF bytes are fill
+        byte = f.read(1)
+        while byte and byte != b"\xff":
+            byte = f.read(1)
+        while byte == b"\xff":
+            byte = f.read(1)
+        if not byte:
+            return None
+
+        marker = byte[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:  # Markers without a length
+            continue
+        if marker in (0xD9, 0xDA):  # End of image or start of scan before any frame header
+            return None
+
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = int.from_bytes(length_bytes, "big")
+
+        if marker in JPEG_SOF_MARKERS:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height = int.from_bytes(data[1:3], "big")
+            width = int.from_bytes(data[3:5], "big")
+            # Orientations 5 to 8 rotate by 90 degrees
+            return (height, width) if orientation in (5, 6, 7, 8) else (width, height)
+
+        if marker == 0xE1:
+            orientation = _exif_orientation(f.read(length - 2))
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def is_image(file_name: str) -> bool:
+    """True for file names with an extension in IMAGE_EXTENSIONS, in any case (.jpg, .JPG, ...)."""
+    return os.path.splitext(file_name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def list_images(images_path: str) -> list[str]:
+    """Absolute paths of every image below images_path in sorted order, subfolders included."""
+    image_paths = []
+    for root, dirs, files in os.walk(images_path):
+        dirs.sort()
+        for file in sorted(files):
+            if is_image(file):
+                image_paths.append(os.path.abspath(os.path.join(root, file)))
+    return image_paths
+
+
+def read_image_size(path: str) -> tuple[int, int] | None:
+    """
+    Width and height of a JPEG, PNG or BMP image from its header.
+
+    Returns:
+        (width, height), or None when the file is missing, truncated or not a supported image
+    """
+    try:
+        with open(path, "rb") as f:
+            header = f.read(26)
+            if header[:2] == b"\xff\xd8":
+                return _jpeg_size(f)
+            if header[:8] == PNG_SIGNATURE and header[12:16] == b"IHDR":
+                return struct.unpack(">II", header[16:24])
+            if header[:2] == b"BM" and len(header) >= 26:
+                if struct.unpack("<I", header[14:18])[0] == 12:  # OS/2 BITMAPCOREHEADER
+                    return struct.unpack("<HH", header[18:22])
+                width, height = struct.unpack("<ii", header[18:26])
+                return width, abs(height)
+    except (OSError, struct.error, ValueError):
+        return None
+    return None
+
+
+def read_image_sizes(paths: list[str], workers: int = 8) -> np.ndarray:
+    """
+    Header sizes of many images, read on a thread pool.
+
+    Returns:
+        (len(paths), 2) int32 array of width, height with -1 for unreadable images
+    """
+    sizes = np.full((len(paths), 2), -1, dtype=np.int32)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for i, size in enumerate(pool.map(read_image_size, paths)):
+            if size is not None:
+                sizes[i] = size
+    unreadable = int((sizes[:, 0] < 0).sum())
+    if unreadable:
+        logger.warning(f"Could not read the size of {unreadable} images")
+    return sizes
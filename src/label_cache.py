@@ -0,0 +1,172 @@
+import os
+import logging
+
+import numpy as np
+
+from .image_index import read_image_sizes
+
+"""
+
+Label index cache
+
+Parsed labels of one labels/<split> directory saved next to it as
+labels/<split>.index.npz. Every label file is keyed by its size and mtime,
+so a refresh only re-parses files that are new or changed.
+
+Contents of the index (all plain arrays, no pickling):
+- names / image_names: newline separated utf-8 blobs of label and image file names
+- sizes, mtimes: signature of every label file when it was parsed
+- images_mtime: mtime of images/<split> when the image names were resolved
+- offsets, classes, boxes: columnar labels, see LabelStore
+- image_sizes (optional): header width, height of every image, -1 where not read yet,
+  UNREADABLE_SIZE (-2) where the header could not be read
+
+"""
+
+logger = logging.getLogger(__name__)
+
+# 2: boxes stored as float64, so cached labels equal the parsed text exactly
+INDEX_VERSION = 2
+
+# Image size of an image whose header could not be read, so it is not read again every run
+UNREADABLE_SIZE = -2
+
+
+def index_path(labels_path: str) -> str:
+    return os.path.normpath(labels_path) + ".index.npz"
+
+
+def pack_names(names: list[str]) -> np.ndarray:
+    return np.frombuffer("\n".join(names).encode("utf-8"), dtype=np.uint8)
+
+
+def unpack_names(blob: np.ndarray, count: int) -> list[str]:
+    if count == 0:
+        return []
+    return blob.tobytes().decode("utf-8").split("\n")
+
+
+class SplitIndex:
+    def __init__(self, names: list[str], sizes: np.ndarray, mtimes: np.ndarray, image_names: list[str],
+                 images_mtime: int, offsets: np.ndarray, classes: np.ndarray, boxes: np.ndarray,
+                 image_sizes: np.ndarray | None = None):
+        self.names = names
+        self.sizes = np.asarray(sizes, dtype=np.int64)
+        self.mtimes = np.asarray(mtimes, dtype=np.int64)
+        self.image_names = image_names
+        self.images_mtime = int(images_mtime)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.classes = np.asarray(classes, dtype=np.int32)
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.image_sizes = None if image_sizes is None else np.asarray(image_sizes, dtype=np.int32).reshape(-1, 2)
+        self._rows = None
+
+    @classmethod
+    def load(cls, path: str) -> "SplitIndex | None":
+        """Read an index file, returns None when it is missing, stale or unreadable."""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if int(data["version"]) != INDEX_VERSION:
+                    logger.info(f"Ignoring label index with old version: {path}")
+                    return None
+                count = len(data["sizes"])
+                return cls(
+                    unpack_names(data["names"], count),
+                    data["sizes"],
+                    data["mtimes"],
+                    unpack_names(data["image_names"], count),
+                    int(data["images_mtime"]),
+                    data["offsets"],
+                    data["classes"],
+                    data["boxes"],
+                    data["image_sizes"] if "image_sizes" in data else None,
+                )
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(f"Could not read label index {path}: {e}")
+            return None
+
+    def save(self, path: str) -> bool:
+        """Write the index atomically, returns False if the directory is not writable."""
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f,
+                    version=np.int64(INDEX_VERSION),
+                    names=pack_names(self.names),
+                    sizes=self.sizes,
+                    mtimes=self.mtimes,
+                    image_names=pack_names(self.image_names),
+                    images_mtime=np.int64(self.images_mtime),
+                    offsets=self.offsets,
+                    classes=self.classes,
+                    boxes=self.boxes,
+                    **({} if self.image_sizes is None else {"image_sizes": self.image_sizes}),
+                )
+            os.replace(tmp_path, path)
+            return True
+        except OSError as e:
+            logger.warning(f"Could not write label index {path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def rows(self) -> dict[str, int]:
+        """Mapping of label file name to its row in the index."""
+        if self._rows is None:
+            self._rows = {name: row for row, name in enumerate(self.names)}
+        return self._rows
+
+    def is_current(self, names: list[str], sizes: np.ndarray, mtimes: np.ndarray, images_mtime: int) -> bool:
+        """True when the directory still holds exactly the files this index was built from."""
+        return (
+            self.images_mtime == images_mtime
+            and self.names == names
+            and np.array_equal(self.sizes, sizes)
+            and np.array_equal(self.mtimes, mtimes)
+        )
+
+    def is_unchanged(self, name: str, size: int, mtime: int) -> bool:
+        row = self.rows.get(name)
+        return row is not None and self.sizes[row] == size and self.mtimes[row] == mtime
+
+    def file_labels(self, row: int) -> tuple[np.ndarray, np.ndarray]:
+        """Class ids and boxes of one label file (views, not copies)."""
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self.classes[start:end], self.boxes[start:end]
+
+    def select_classes(self, classes: frozenset[int]) -> "SplitIndex":
+        """Copy of the index holding only boxes of the given classes, files are kept."""
+        keep = np.isin(self.classes, np.fromiter(classes, dtype=np.int32))
+        file_index = np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.offsets))
+        offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(file_index[keep], minlength=len(self)), out=offsets[1:])
+        return SplitIndex(self.names, self.sizes, self.mtimes, self.image_names, self.images_mtime,
+                          offsets, self.classes[keep], self.boxes[keep], self.image_sizes)
+
+    def fill_image_sizes(self, images_path: str, workers: int = 8) -> bool:
+        """
+        Read the header size of every image not yet in the index.
+
+        Images whose header cannot be read are recorded as UNREADABLE_SIZE and
+        not tried again while the images folder is unchanged.
+
+        Returns:
+            True if any size was read and the index should be saved
+        """
+        if self.image_sizes is None:
+            self.image_sizes = np.full((len(self), 2), -1, dtype=np.int32)
+        missing = np.flatnonzero(self.image_sizes[:, 0] == -1)
+        if len(missing) == 0:
+            return False
+        paths = [os.path.join(images_path, self.image_names[row]) for row in missing]
+        sizes = read_image_sizes(paths, workers)
+        sizes[sizes[:, 0] < 0] = UNREADABLE_SIZE
+        self.image_sizes[missing] = sizes
+        return True
@@ -0,0 +1,264 @@
+import sys
+from collections.abc import Sequence
+
+import numpy as np
+
+"""
+
+Columnar label store
+
+Struct-of-arrays backing store for YOLODataset. Instead of one dict per box,
+every box of every image lives in a single float32 array and images are
+addressed through an offsets array:
+
+    boxes[offsets[i]:offsets[i + 1]]    -> (n, 4) x_center, y_center, width, height
+    classes[offsets[i]:offsets[i + 1]]  -> (n,) class ids
+
+Paths are interned and splits are stored as small integer codes, so memory
+scales with the number of boxes rather than with the number of Python objects.
+
+"""
+
+
+def denormalise_boxes(boxes: np.ndarray, width: float, height: float) -> np.ndarray:
+    """Convert normalised (x_center, y_center, width, height) rows to pixel x1, y1, x2, y2."""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    scale = np.array([width, height], dtype=np.float64)
+    centers = boxes[:, :2] * scale
+    half = boxes[:, 2:] * scale / 2
+    return np.concatenate([centers - half, centers + half], axis=1)
+
+
+def parse_label_file(file_path: str, classes_of_interest: frozenset[int] | None = None
+                     ) -> tuple[list[int], list[tuple[float, float, float, float]]]:
+    """
+    Parse one YOLO label file, skipping empty and malformed lines.
+
+    Args:
+        file_path: path to the .txt label file
+        classes_of_interest: if given, boxes of any other class are dropped while parsing
+
+    Returns:
+        (classes, boxes) where boxes are (x_center, y_center, width, height) rows
+    """
+    classes = []
+    boxes = []
+    with open(file_path, "r") as f:
+        for line in f:
+            # Split the line into parts
+            parts = line.split()
+            if len(parts) != 5:  # Skip empty and malformed lines
+                continue
+
+            try:
+                # The first part is the class
+                obj_class = int(parts[0])
+                box = (float(parts[1]), float(parts[2]), float(parts[3]), float(parts[4]))
+            except ValueError:
+                # Skip lines with invalid data
+                continue
+
+            if classes_of_interest is not None and obj_class not in classes_of_interest:
+                continue
+
+            classes.append(obj_class)
+            boxes.append(box)
+    return classes, boxes
+
+
+class LabelStore:
+    def __init__(self, image_paths: list[str], label_paths: list[str], splits: list[str],
+                 image_split: np.ndarray, offsets: np.ndarray, classes: np.ndarray, boxes: np.ndarray):
+        self.image_paths = [sys.intern(p) for p in image_paths]
+        self.label_paths = [sys.intern(p) for p in label_paths]
+        self.splits = list(splits)
+        self.image_split = np.asarray(image_split, dtype=np.int16)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.classes = np.asarray(classes, dtype=np.int32)
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self._box_image_index = None
+        self._class_index = None
+
+    @classmethod
+    def from_parsed(cls, entries: list[tuple]) -> "LabelStore":
+        """
+        Build a store from parsed label files.
+
+        Args:
+            entries: (image_path, label_path, split, classes, boxes) tuples, where classes
+                     is a sequence of ints and boxes a sequence of 4-float rows
+        """
+        splits = []
+        split_codes = {}
+        image_paths, label_paths, image_split = [], [], []
+        counts, class_chunks, box_chunks = [], [], []
+
+        for image_path, label_path, split, classes, boxes in entries:
+            if split not in split_codes:
+                split_codes[split] = len(splits)
+                splits.append(split)
+            image_paths.append(image_path)
+            label_paths.append(label_path)
+            image_split.append(split_codes[split])
+            counts.append(len(classes))
+            class_chunks.append(np.asarray(classes, dtype=np.int32))
+            box_chunks.append(np.asarray(boxes, dtype=np.float32).reshape(-1, 4))
+
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        classes = np.concatenate(class_chunks) if class_chunks else np.zeros(0, dtype=np.int32)
+        boxes = np.concatenate(box_chunks) if box_chunks else np.zeros((0, 4), dtype=np.float32)
+        return cls(image_paths, label_paths, splits, image_split, offsets, classes, boxes)
+
+    @classmethod
+    def from_records(cls, records: list[dict]) -> "LabelStore":
+        """Build a store from the legacy list-of-dicts label format."""
+        entries = []
+        for record in records:
+            labels = record["labels"]
+            entries.append((
+                record["image_path"],
+                record["label_path"],
+                record["split"],
+                [obj["obj_class"] for obj in labels],
+                [(obj["x_center"], obj["y_center"], obj["width"], obj["height"]) for obj in labels],
+            ))
+        return cls.from_parsed(entries)
+
+    def __len__(self) -> int:
+        return len(self.image_paths)
+
+    @property
+    def num_boxes(self) -> int:
+        return len(self.classes)
+
+    @property
+    def box_image_index(self) -> np.ndarray:
+        """Image index of every box, shape (num_boxes,)."""
+        if self._box_image_index is None:
+            self._box_image_index = np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.offsets))
+        return self._box_image_index
+
+    @property
+    def class_index(self) -> dict[int, np.ndarray]:
+        """Mapping of class id to the sorted indices of images containing that class."""
+        if self._class_index is None:
+            pairs = np.unique(np.stack([self.classes.astype(np.int64), self.box_image_index]), axis=1)
+            class_ids, starts = np.unique(pairs[0], return_index=True)
+            self._class_index = {
+                int(class_id): images
+                for class_id, images in zip(class_ids, np.split(pairs[1], starts[1:]))
+            }
+        return self._class_index
+
+    def split_of(self, index: int) -> str:
+        return self.splits[self.image_split[index]]
+
+    def image_boxes(self, index: int) -> tuple[np.ndarray, np.ndarray]:
+        """Class ids and normalised boxes of one image (views, not copies)."""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.classes[start:end], self.boxes[start:end]
+
+    def box_mask(self, classes: list[int]) -> np.ndarray:
+        """Boolean mask over all boxes that belong to any of the given classes."""
+        return np.isin(self.classes, np.asarray(list(classes), dtype=np.int32))
+
+    def images_with_classes(self, classes: list[int]) -> np.ndarray:
+        """Sorted indices of images containing at least one box of the given classes."""
+        found = [self.class_index[c] for c in classes if c in self.class_index]
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+    def class_counts(self, minlength: int = 0) -> np.ndarray:
+        """Number of boxes per class id, negative ids (hand-edited or foreign label files) are not counted."""
+        classes = self.classes[self.classes >= 0]
+        if len(classes) == 0:
+            return np.zeros(minlength, dtype=np.int64)
+        return np.bincount(classes, minlength=minlength)
+
+    def denormalise(self, sizes: np.ndarray) -> np.ndarray:
+        """
+        Pixel x1, y1, x2, y2 of every box.
+
+        Args:
+            sizes: (num_images, 2) array of image width, height
+        """
+        scale = np.asarray(sizes, dtype=np.float64)[self.box_image_index]
+        boxes = self.boxes.astype(np.float64)
+        centers = boxes[:, :2] * scale
+        half = boxes[:, 2:] * scale / 2
+        return np.concatenate([centers - half, centers + half], axis=1)
+
+    def select_boxes(self, keep: np.ndarray, drop_empty: bool = True) -> "LabelStore":
+        """
+        New store holding only the boxes where keep is True.
+
+        Args:
+            keep: boolean mask over all boxes
+            drop_empty: remove images left without any boxes
+        """
+        counts = np.bincount(self.box_image_index[keep], minlength=len(self))
+        images = np.flatnonzero(counts > 0) if drop_empty else np.arange(len(self))
+        offsets = np.zeros(len(images) + 1, dtype=np.int64)
+        np.cumsum(counts[images], out=offsets[1:])
+        return LabelStore(
+            [self.image_paths[i] for i in images],
+            [self.label_paths[i] for i in images],
+            self.splits,
+            self.image_split[images],
+            offsets,
+            self.classes[keep],
+            self.boxes[keep],
+        )
+
+    def record(self, index: int) -> dict:
+        """Legacy dict view of one image, see YOLODataset for the format."""
+        classes, boxes = self.image_boxes(index)
+        labels = [
+            {
+                "obj_class": int(obj_class),
+                "x_center": float(box[0]),
+                "y_center": float(box[1]),
+                "width": float(box[2]),
+                "height": float(box[3]),
+            }
+            for obj_class, box in zip(classes.tolist(), boxes.tolist())
+        ]
+        return {
+            "image_path": self.image_paths[index],
+            "label_path": self.label_paths[index],
+            "labels": labels,
+            "split": self.split_of(index),
+            "available_classes": set(classes.tolist()),
+        }
+
+    def records(self) -> "LabelRecords":
+        return LabelRecords(self)
+
+
+class LabelRecords(Sequence):
+    """
+    Read-only list-of-dicts view over a LabelStore.
+
+    Dicts are built on access, so mutating them does not change the store.
+    """
+
+    def __init__(self, store: LabelStore):
+        self.store = store
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.store.record(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("label index out of range")
+        return self.store.record(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.store.record(index)
@@ -0,0 +1,175 @@
+import os
+import math
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import yaml
+from tqdm import tqdm
+
+from .image_index import list_images, read_image_size
+from .utils import link_or_copy
+
+"""
+
+Pre-resized training images
+
+Ultralytics resizes every image so its long side equals imgsz right after decoding.
+Doing that once ahead of training means every epoch and every cache build decodes
+imgsz sized images instead of full resolution sources.
+
+The dataset is mirrored into a new root:
+- images larger than imgsz are downscaled (INTER_AREA) so the long side is imgsz
+- images that are already small enough and all label files are hardlinked
+- a new data YAML pointing at the mirrored tree is written
+
+Labels are normalised, so they stay valid for the resized images.
+
+"""
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def _label_path(image_path: str) -> str:
+    """Label file of an image, the same mapping Ultralytics uses (last /images/ becomes /labels/)."""
+    images_dir, labels_dir = f"{os.sep}images{os.sep}", f"{os.sep}labels{os.sep}"
+    head, _, tail = image_path.rpartition(images_dir)
+    return os.path.splitext(f"{head}{labels_dir}{tail}")[0] + ".txt"
+
+
+def _reduced_read_flag(size: tuple[int, int] | None, imgsz: int) -> int:
+    """Largest JPEG decode-time reduction that still leaves the long side at least imgsz."""
+    if size is not None:
+        long_side = max(size)
+        for factor, flag in [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)]:
+            if long_side // factor >= imgsz:
+                return flag
+    return cv2.IMREAD_COLOR
+
+
+def _resize_sample(task: tuple) -> str:
+    """Mirror one image and its label file, returns 'resized', 'linked', 'skipped' or 'failed'."""
+    src, dst, imgsz = task
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+
+    # Keep labels in step with the image even when the image itself is up to date
+    src_label, dst_label = _label_path(src), _label_path(dst)
+    if os.path.exists(src_label):
+        os.makedirs(os.path.dirname(dst_label), exist_ok=True)
+        link_or_copy(src_label, dst_label)
+
+    if os.path.exists(dst) and os.path.getmtime(dst) >= os.path.getmtime(src):
+        return "skipped"
+
+    size = read_image_size(src)
+    if size is not None and max(size) <= imgsz:
+        link_or_copy(src, dst)
+        return "linked"
+
+    image = cv2.imread(src, _reduced_read_flag(size, imgsz))
+    if image is None:
+        logger.warning(f"Could not load image: {src}")
+        return "failed"
+
+    # Target size from the original size and the same formula as Ultralytics load_image,
+    # so the mirrored image is exactly what training would resize to and is not resized again
+    width, height = size if size is not None else image.shape[1::-1]
+    scale = imgsz / max(height, width)
+    if scale < 1:
+        target = (min(math.ceil(width * scale), imgsz), min(math.ceil(height * scale), imgsz))
+        if image.shape[1::-1] != target:
+            image = cv2.resize(image, target, interpolation=cv2.INTER_AREA)
+    if not cv2.imwrite(dst, image, [cv2.IMWRITE_JPEG_QUALITY, 95]):
+        logger.warning(f"Could not write image: {dst}")
+        return "failed"
+    return "resized"
+
+
+def _mirror_path(image_path: str, root: str, output_path: str) -> str:
+    """
+    Path of an image in the mirrored tree.
+
+    Images outside the dataset root (absolute manifest entries, ../ paths) would map
+    outside the output folder, they are mirrored below <output>/_external/ by their
+    absolute path instead.
+    """
+    relative = os.path.relpath(image_path, root)
+    if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+        relative = os.path.join("_external", os.path.abspath(image_path).lstrip(os.sep))
+    return os.path.join(output_path, relative)
+
+
+def _dataset_root(data: dict, data_path: str) -> str:
+    root = data.get("path", ".")
+    if os.path.isabs(root) or os.path.exists(root):
+        return os.path.abspath(root)
+    # Relative to the YAML file otherwise
+    return os.path.abspath(os.path.join(os.path.dirname(data_path), root))
+
+
+def resize_dataset(data_path: str, imgsz: int = 640, output_path: str | None = None, workers: int = 8) -> str:
+    """
+    Write a copy of a YOLO dataset downscaled to imgsz and a data YAML pointing at it.
+
+    Images already up to date in the output are skipped, so re-running after adding
+    data only processes the new images.
+
+    Args:
+        data_path: data YAML of the dataset, split entries may be folders or image list .txt files
+        imgsz: training image size, the long side of every larger image is scaled to it
+        output_path: root of the resized dataset, defaults to <root>_<imgsz>
+        workers: number of resize threads
+
+    Returns:
+        Path of the data YAML of the resized dataset
+    """
+    with open(data_path, "r") as f:
+        data = yaml.safe_load(f)
+
+    root = _dataset_root(data, data_path)
+    output_path = os.path.abspath(output_path or f"{root}_{imgsz}")
+    logger.info(f"Resizing {root} to {imgsz} into {output_path}")
+
+    tasks = []
+    for key in ["train", "val", "test"]:
+        value = data.get(key)
+        if not isinstance(value, str):
+            continue
+
+        source = value if os.path.isabs(value) else os.path.join(root, value)
+        if source.endswith(".txt"):
+            with open(source, "r") as f:
+                image_paths = [os.path.abspath(line.strip()) for line in f if line.strip()]
+        elif os.path.isdir(source):
+            image_paths = list_images(source)
+        else:
+            logger.warning(f"Missing {key} split: {source}")
+            continue
+
+        mirrored = [_mirror_path(image_path, root, output_path) for image_path in image_paths]
+        tasks.extend((src, dst, imgsz) for src, dst in zip(image_paths, mirrored))
+
+        if source.endswith(".txt"):
+            # Image lists are rewritten to point at the mirrored images
+            manifest_path = os.path.join(output_path, f"{key}.txt")
+            os.makedirs(output_path, exist_ok=True)
+            with open(manifest_path, "w") as f:
+                f.writelines(f"{path}\n" for path in mirrored)
+            data[key] = manifest_path
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(tqdm(pool.map(_resize_sample, tasks), total=len(tasks), desc="Resizing images"))
+
+    counts = {result: results.count(result) for result in ["resized", "linked", "skipped", "failed"]}
+    logger.info(f"Resize completed: {counts['resized']} resized, {counts['linked']} linked, "
+                f"{counts['skipped']} up to date, {counts['failed']} failed")
+
+    data["path"] = output_path
+    output_yaml = os.path.join(output_path, "data.yaml")
+    os.makedirs(output_path, exist_ok=True)
+    with open(output_yaml, "w") as f:
+        yaml.dump(data, f, default_flow_style=False, sort_keys=False)
+    logger.info(f"Resized data YAML saved to: {output_yaml}")
+    return output_yaml
@@ -0,0 +1,240 @@
+import os
+import logging
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from .image_index import list_images
+from .label_cache import pack_names, unpack_names
+from .label_store import parse_label_file
+
+"""
+
+Packed shard format
+
+A YOLO split packed into a few large files instead of thousands of small ones:
+
+    <output>/<split>-00000.shard, <split>-00001.shard, ...
+        encoded image files (jpg, png, ...) copied back to back, unchanged
+    <output>/<split>.shards.npz
+        names: newline separated utf-8 blob of image paths relative to images/<split>
+        shard, offset, length: where the bytes of every image are
+        label_offsets, classes, boxes: columnar labels, see LabelStore
+
+Samples are written in order, so reading them in index order is one sequential
+pass per shard. ShardReader memory-maps the shards and serves samples by index.
+
+"""
+
+logger = logging.getLogger(__name__)
+
+SHARD_VERSION = 1
+
+
+def shard_index_path(shards_path: str, split: str) -> str:
+    return os.path.join(shards_path, f"{split}.shards.npz")
+
+
+def shard_path(shards_path: str, split: str, shard: int) -> str:
+    return os.path.join(shards_path, f"{split}-{shard:05d}.shard")
+
+
+def _read_sample(paths: tuple[str, str]) -> tuple[bytes | None, list[int], list[tuple]]:
+    """Encoded image bytes and parsed labels of one sample, image bytes are None when unreadable."""
+    image_path, label_path = paths
+    try:
+        with open(image_path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None, [], []
+    if not os.path.exists(label_path):
+        return data, [], []
+    classes, boxes = parse_label_file(label_path)
+    return data, classes, boxes
+
+
+def _read_manifest(manifest_path: str) -> list[str]:
+    with open(manifest_path, "r") as f:
+        return [os.path.abspath(line.strip()) for line in f if line.strip()]
+
+
+def export_shards(dataset_path: str, output_path: str, splits=["train", "val"], shard_size: int = 1 << 30,
+                  workers: int = 8, manifests: dict[str, str] | None = None) -> dict[str, str]:
+    """
+    Pack the images and labels of a YOLO dataset into shards.
+
+    Args:
+        dataset_path: root of the dataset with images/<split> and labels/<split> folders
+        output_path: folder for the shards and their index files
+        splits: splits to export
+        shard_size: a new shard is started once a shard would grow past this many bytes
+        workers: number of threads reading the small files
+        manifests: optional dict of split to image list (e.g. from dedup_yolo_dataset),
+                   only the listed images of that split are exported
+
+    Returns:
+        Dict of split to index file path
+    """
+    logger.info(f"Starting shard export of {dataset_path} to {output_path}")
+    os.makedirs(output_path, exist_ok=True)
+
+    indexes = {}
+    for split in splits:
+        images_path = os.path.abspath(os.path.join(dataset_path, "images", split))
+        labels_path = os.path.abspath(os.path.join(dataset_path, "labels", split))
+        if manifests is not None and split in manifests:
+            image_paths = _read_manifest(manifests[split])
+        elif os.path.exists(images_path):
+            image_paths = list_images(images_path)
+        else:
+            logger.warning(f"Missing {split} split in {dataset_path}")
+            continue
+
+        names = [os.path.relpath(image_path, images_path) for image_path in image_paths]
+        label_paths = [os.path.join(labels_path, os.path.splitext(name)[0] + ".txt") for name in names]
+
+        kept_names, shards, offsets, lengths = [], [], [], []
+        counts, class_chunks, box_chunks = [], [], []
+        shard, shard_bytes, shard_file = -1, 0, None
+        skipped = 0
+
+        samples = iter(zip(image_paths, label_paths))
+        progress = tqdm(total=len(image_paths), desc=f"Packing {split}")
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                # Read in bounded chunks so only a few hundred files are held in memory
+                while chunk := list(islice(samples, max(1, workers) * 16)):
+                    for (image_path, _), (data, classes, boxes) in zip(chunk, pool.map(_read_sample, chunk)):
+                        progress.update(1)
+                        if not data:
+                            skipped += 1
+                            continue
+
+                        if shard_file is None or (shard_bytes > 0 and shard_bytes + len(data) > shard_size):
+                            if shard_file is not None:
+                                shard_file.close()
+                            shard += 1
+                            shard_bytes = 0
+                            shard_file = open(shard_path(output_path, split, shard), "wb")
+
+                        shard_file.write(data)
+                        kept_names.append(os.path.relpath(image_path, images_path))
+                        shards.append(shard)
+                        offsets.append(shard_bytes)
+                        lengths.append(len(data))
+                        shard_bytes += len(data)
+
+                        counts.append(len(classes))
+                        class_chunks.append(np.asarray(classes, dtype=np.int32))
+                        box_chunks.append(np.asarray(boxes, dtype=np.float32).reshape(-1, 4))
+        finally:
+            progress.close()
+            if shard_file is not None:
+                shard_file.close()
+
+        label_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=label_offsets[1:])
+
+        index_file = shard_index_path(output_path, split)
+        tmp_path = index_file + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                version=np.int64(SHARD_VERSION),
+                names=pack_names(kept_names),
+                shard=np.asarray(shards, dtype=np.int32),
+                offset=np.asarray(offsets, dtype=np.int64),
+                length=np.asarray(lengths, dtype=np.int64),
+                shard_count=np.int64(shard + 1),
+                label_offsets=label_offsets,
+                classes=np.concatenate(class_chunks) if class_chunks else np.zeros(0, dtype=np.int32),
+                boxes=np.concatenate(box_chunks) if box_chunks else np.zeros((0, 4), dtype=np.float32),
+            )
+        os.replace(tmp_path, index_file)
+        indexes[split] = index_file
+
+        if skipped:
+            logger.warning(f"Skipped {skipped} unreadable images in {split} split")
+        logger.info(f"{split}: packed {len(kept_names)} images into {shard + 1} shards")
+
+    return indexes
+
+
+class ShardReader:
+    """
+    Random access to one exported split by sample index.
+
+    Shards are memory-mapped on first use, so only the pages of the samples that are
+    read get loaded. The reader can be pickled to dataloader workers, every process
+    maps the shards again.
+    """
+
+    def __init__(self, shards_path: str, split: str, decode: bool = True):
+        self.shards_path = shards_path
+        self.split = split
+        self.decode = decode
+
+        with np.load(shard_index_path(shards_path, split), allow_pickle=False) as data:
+            if int(data["version"]) != SHARD_VERSION:
+                raise ValueError(f"Unsupported shard index version in {shards_path}")
+            self.shard = data["shard"]
+            self.offset = data["offset"]
+            self.length = data["length"]
+            self.shard_count = int(data["shard_count"])
+            self.label_offsets = data["label_offsets"]
+            self.classes = data["classes"]
+            self.boxes = data["boxes"]
+            self.names = unpack_names(data["names"], len(self.shard))
+        self._shards = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_shards"] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _mapped(self, shard: int) -> np.memmap:
+        if self._shards is None:
+            self._shards = [None] * self.shard_count
+        if self._shards[shard] is None:
+            self._shards[shard] = np.memmap(shard_path(self.shards_path, self.split, shard), dtype=np.uint8, mode="r")
+        return self._shards[shard]
+
+    def image_bytes(self, index: int) -> np.ndarray:
+        """Encoded image of one sample, a view into the mapped shard."""
+        start = self.offset[index]
+        return self._mapped(self.shard[index])[start:start + self.length[index]]
+
+    def labels(self, index: int) -> tuple[np.ndarray, np.ndarray]:
+        """Class ids and normalised boxes of one sample (views, not copies)."""
+        start, end = self.label_offsets[index], self.label_offsets[index + 1]
+        return self.classes[start:end], self.boxes[start:end]
+
+    def __getitem__(self, index: int) -> dict:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("shard index out of range")
+
+        data = self.image_bytes(index)
+        classes, boxes = self.labels(index)
+        return {
+            "image_path": self.names[index],
+            "image": cv2.imdecode(data, cv2.IMREAD_COLOR) if self.decode else data,
+            "classes": classes,
+            "boxes": boxes,
+        }
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def read_order(self, indices) -> np.ndarray:
+        """Indices sorted by their position on disk, for sequential reads of a random subset."""
+        indices = np.asarray(indices, dtype=np.int64)
+        return indices[np.lexsort((self.offset[indices], self.shard[indices]))]
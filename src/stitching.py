@@ -1,8 +1,16 @@
 import os
 import random
 import logging
+import threading
+from collections import OrderedDict
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
+import numpy as np
+
+from .image_index import read_image_size
+from .label_cache import pack_names, unpack_names
 
 # Set up logger
 logger = logging.getLogger(__name__)
@@ -11,13 +19,164 @@ logger = logging.getLogger(__name__)
 Include augmentations like partial block out, blur, etc.
 """
 
+# cv2.convertScaleAbs(alpha=1.5) as a lookup table, used by saturation, brightness and contrast
+SCALE_LUT = np.clip(np.round(np.arange(256) * 1.5), 0, 255).astype(np.uint8)
+
+
+def _randint(rng, low: int, high: int) -> int:
+    """Random integer in [low, high] from rng, or the global random module when rng is None."""
+    if rng is None:
+        return random.randint(low, high)
+    return int(rng.integers(low, high + 1))
+
+
+def _random(rng) -> float:
+    return random.random() if rng is None else float(rng.random())
+
+
+# Attempts to find a readable crop before giving up, files can disappear after validation
+MAX_READ_ATTEMPTS = 10
+
+
+class AliasTable:
+    """Vose alias table, draws from a fixed discrete distribution in O(1) per sample."""
+
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        if len(weights) == 0 or weights.min() < 0 or weights.sum() <= 0:
+            raise ValueError("Weights must be non-negative with a positive sum")
+
+        n = len(weights)
+        scaled = weights * n / weights.sum()
+        self.prob = np.ones(n, dtype=np.float64)
+        self.alias = np.arange(n, dtype=np.int64)
+
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] += scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+        # Whatever is left has probability 1 up to rounding
+
+    def __len__(self) -> int:
+        return len(self.prob)
+
+    def draw(self, u: float, v: float) -> int:
+        """One index from two uniform numbers in [0, 1)."""
+        i = min(int(u * len(self)), len(self) - 1)
+        return i if v < self.prob[i] else int(self.alias[i])
+
+    def sample(self, rng: np.random.Generator, size: int) -> np.ndarray:
+        i = rng.integers(len(self), size=size)
+        return np.where(rng.random(size) < self.prob[i], i, self.alias[i])
+
+
+def _read_atlas_table(atlas_path: str) -> dict | None:
+    table_path = atlas_path + ".npz"
+    if not os.path.exists(atlas_path) or not os.path.exists(table_path):
+        return None
+    try:
+        with np.load(table_path, allow_pickle=False) as data:
+            return {
+                "sources": unpack_names(data["sources"], len(data["sizes"])),
+                "sizes": data["sizes"],
+                "mtimes": data["mtimes"],
+                "names": unpack_names(data["names"], len(data["offsets"])),
+                "offsets": data["offsets"],
+                "shapes": data["shapes"],
+            }
+    except (OSError, KeyError, ValueError) as e:
+        logger.warning(f"Could not read crop atlas table {table_path}: {e}")
+        return None
+
+
+def _build_atlas(atlas_path: str, paths: list[str], sizes: np.ndarray, mtimes: np.ndarray, workers: int = 8) -> dict:
+    """Decode every crop and write the atlas file and its table, unreadable crops are left out."""
+    logger.info(f"Building crop atlas {atlas_path} from {len(paths)} crops")
+    names, offsets, shapes = [], [], []
+    offset = 0
+
+    tmp_path = atlas_path + ".tmp"
+    crops = iter(paths)
+    with open(tmp_path, "wb") as f, ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        # Decode in bounded chunks so only a few hundred crops are held in memory
+        while chunk := list(islice(crops, max(1, workers) * 16)):
+            for crop_path, image in zip(chunk, pool.map(cv2.imread, chunk)):
+                if image is None:
+                    logger.warning(f"Dropping unreadable crop: {crop_path}")
+                    continue
+                f.write(np.ascontiguousarray(image).tobytes())
+                names.append(crop_path)
+                offsets.append(offset)
+                shapes.append(image.shape)
+                offset += image.nbytes
+    if offset == 0:
+        os.remove(tmp_path)
+        raise ValueError(f"No readable crops to build the atlas {atlas_path} from")
+    os.replace(tmp_path, atlas_path)
+
+    table = {
+        "sources": paths,
+        "sizes": sizes,
+        "mtimes": mtimes,
+        "names": names,
+        "offsets": np.asarray(offsets, dtype=np.int64),
+        "shapes": np.asarray(shapes, dtype=np.int64).reshape(-1, 3),
+    }
+    table_tmp_path = atlas_path + ".npz.tmp"
+    with open(table_tmp_path, "wb") as f:
+        np.savez(f, sources=pack_names(paths), sizes=sizes, mtimes=mtimes, names=pack_names(names),
+                 offsets=table["offsets"], shapes=table["shapes"])
+    os.replace(table_tmp_path, atlas_path + ".npz")
+    logger.info(f"Crop atlas written: {len(names)} crops, {offset / 1e6:.1f} MB")
+    return table
+
 
 class StitchingCrops:
-    def __init__(self, path):
+    def __init__(self, path, cache_bytes: int = 256 * 1024 * 1024, preload: bool = False, workers: int = 8,
+                 class_weights: dict[str, float] | None = None, validate: bool = True, atlas: str | None = None):
+        """
+        Args:
+            path: folder with one sub folder of crops per class
+            cache_bytes: byte budget of the decoded crop cache, 0 disables caching
+            preload: decode crops up front (in parallel) until the cache budget is used
+            workers: number of decode threads for validation and preloading
+            class_weights: relative sampling weight per class folder name, missing classes
+                           weigh 1, so the default samples classes uniformly
+            validate: decode every crop once at load time and drop unreadable ones
+            atlas: path of a packed crop atlas to serve crops from (see load_atlas),
+                   replaces validation and the cache
+        """
         self.path = path
         self.crops = {} 
         self.classes = []
+        self.dropped_classes = []  # Classes removed by validation for having no readable crops
+
+        # Decoded crops by file path, least recently used first
+        self.cache_bytes = cache_bytes
+        self._cache = OrderedDict()
+        self._cache_size = 0
+        self._cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+
+        # Packed atlas of decoded crops, mapped on first use
+        self.atlas_path = None
+        self._atlas = None
+
         self.load_crops()
+        if atlas is not None:
+            self.load_atlas(atlas, workers)
+        elif validate:
+            # Validation decodes every crop anyway, so preloading comes for free
+            self.validate_crops(workers, cache=preload)
+        elif preload:
+            self.preload(workers)
+        self.set_class_weights(class_weights)
         logger.info(f"Initialized StitchingCrops with path: {path}")
 
     def load_crops(self):
@@ -30,75 +189,295 @@ class StitchingCrops:
             logger.debug(f"Loaded {len(self.crops[folder])} crops for class '{folder}'")
         logger.info(f"Finished loading crops. Total classes: {len(self.classes)}")
 
-    def get_random_crop(self):
-        # Get random class
-        chosen_class = random.choice(self.classes)
+    def validate_crops(self, workers: int = 8, cache: bool = False):
+        """
+        Check every crop on a thread pool and drop the unreadable ones.
+
+        Classes left without any crops are removed. With cache=True every crop is
+        decoded and kept in the cache until its byte budget is used. Without it only
+        the image header is read (see read_image_size), crops whose header cannot be
+        parsed are decoded to decide. A crop with a valid header but corrupt pixel
+        data is then only caught when it is read, where it is skipped and redrawn.
+        """
+        paths = [crop for folder in self.classes for crop in self.crops[folder]]
+        readable = set()
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            if cache:
+                for crop_path, image in zip(paths, pool.map(cv2.imread, paths)):
+                    if image is None:
+                        logger.warning(f"Dropping unreadable crop: {crop_path}")
+                        continue
+                    readable.add(crop_path)
+                    if self._cache_size + image.nbytes <= self.cache_bytes:
+                        self._cache_put(crop_path, image)
+            else:
+                for crop_path, size in zip(paths, pool.map(read_image_size, paths)):
+                    if size is None or min(size) <= 0:
+                        # Unsupported or broken header, let the decoder decide
+                        if cv2.imread(crop_path) is None:
+                            logger.warning(f"Dropping unreadable crop: {crop_path}")
+                            continue
+                    readable.add(crop_path)
+
+        self._keep_crops(readable)
+        logger.info(f"Validated {len(readable)} of {len(paths)} crops")
+
+    def _keep_crops(self, readable: set):
+        """Drop crops not in readable, and classes left without any crops."""
+        for folder in list(self.classes):
+            self.crops[folder] = [crop for crop in self.crops[folder] if crop in readable]
+            if not self.crops[folder]:
+                logger.warning(f"No readable crops for class '{folder}', removing it")
+                self.dropped_classes.append(folder)
+                self.classes.remove(folder)
+                del self.crops[folder]
+
+    def load_atlas(self, atlas_path: str, workers: int = 8):
+        """
+        Serve crops from a packed atlas of decoded pixels, memory-mapped read-only.
+
+        The atlas is one file with all decoded crops back to back plus a table
+        (atlas_path + ".npz") of their offsets and shapes. It is rebuilt when missing or
+        when any crop file changed. Every process mapping it shares the same physical
+        pages, so parallel workers do not each hold a copy of the crop bank.
+        """
+        paths = [crop for folder in self.classes for crop in self.crops[folder]]
+        stats = [os.stat(crop) for crop in paths]
+        sizes = np.array([stat.st_size for stat in stats], dtype=np.int64)
+        mtimes = np.array([stat.st_mtime_ns for stat in stats], dtype=np.int64)
 
-        # Get random crop
-        chosen_crop = random.choice(self.crops[chosen_class])
+        table = _read_atlas_table(atlas_path)
+        if (table is None or table["sources"] != paths
+                or not np.array_equal(table["sizes"], sizes) or not np.array_equal(table["mtimes"], mtimes)):
+            table = _build_atlas(atlas_path, paths, sizes, mtimes, workers)
 
-        image = cv2.imread(chosen_crop)
+        self._keep_crops(set(table["names"]))
+        self.atlas_path = atlas_path
+        self._atlas = None
+        self._atlas_rows = {name: row for row, name in enumerate(table["names"])}
+        self._atlas_offsets = table["offsets"]
+        self._atlas_shapes = table["shapes"]
+        logger.info(f"Using crop atlas {atlas_path} with {len(self._atlas_rows)} crops")
+
+    def atlas_crop(self, crop_path) -> np.ndarray:
+        """Read-only view of one crop in the mapped atlas, no decoding or copying."""
+        if self._atlas is None:
+            self._atlas = np.memmap(self.atlas_path, dtype=np.uint8, mode="r")
+        row = self._atlas_rows[crop_path]
+        start = self._atlas_offsets[row]
+        shape = tuple(self._atlas_shapes[row])
+        return self._atlas[start:start + int(np.prod(shape))].reshape(shape)
+
+    def __getstate__(self):
+        # Locks and memory maps do not pickle, workers map the atlas again and start with an empty cache
+        state = self.__dict__.copy()
+        state["_cache_lock"] = None
+        state["_cache"] = OrderedDict()
+        state["_cache_size"] = 0
+        state["_atlas"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cache_lock = threading.Lock()
+
+    def set_class_weights(self, class_weights: dict[str, float] | None = None):
+        """Rebuild the class sampling table, see class_weights in __init__."""
+        if not self.classes:
+            dropped = f", classes dropped for having no readable crops: {self.dropped_classes}" if self.dropped_classes else ""
+            raise ValueError(f"No readable crops in {self.path}{dropped}")
+        empty = [folder for folder in self.classes if not self.crops[folder]]
+        if empty:
+            raise ValueError(f"Crop classes without any crops in {self.path}: {empty}")
+        class_weights = class_weights or {}
+        unknown = set(class_weights) - set(self.classes)
+        if unknown:
+            logger.warning(f"Ignoring weights of unknown classes: {sorted(unknown)}")
+        self.class_weights = [float(class_weights.get(folder, 1.0)) for folder in self.classes]
+        invalid = [folder for folder, weight in zip(self.classes, self.class_weights) if not weight >= 0]
+        if invalid or sum(self.class_weights) <= 0:
+            raise ValueError(f"Class weights must be non-negative with a positive sum, got "
+                             f"{dict(zip(self.classes, self.class_weights))} for {self.path}")
+        self._class_table = AliasTable(self.class_weights)
+        self._class_sizes = np.array([len(self.crops[folder]) for folder in self.classes], dtype=np.int64)
+
+    def _cache_put(self, crop_path, image):
+        if image.nbytes > self.cache_bytes:
+            return
+        with self._cache_lock:
+            if crop_path in self._cache:
+                return
+            self._cache[crop_path] = image
+            self._cache_size += image.nbytes
+            while self._cache_size > self.cache_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_size -= evicted.nbytes
+                self.cache_evictions += 1
+
+    def read_crop(self, crop_path):
+        """
+        Decoded crop, from the cache when possible.
+
+        Returns a copy the caller may modify (augmentations work in place), None if unreadable.
+        """
+        if self.atlas_path is not None:
+            return self.atlas_crop(crop_path).copy()
+
+        with self._cache_lock:
+            image = self._cache.get(crop_path)
+            if image is not None:
+                self._cache.move_to_end(crop_path)
+                self.cache_hits += 1
+                return image.copy()
+            self.cache_misses += 1
+
+        image = cv2.imread(crop_path)
         if image is None:
+            return None
+        self._cache_put(crop_path, image)
+        return image.copy()
+
+    def preload(self, workers: int = 8):
+        """Decode crops into the cache until its byte budget is used."""
+        paths = [crop for folder in self.classes for crop in self.crops[folder]]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for crop_path, image in zip(paths, pool.map(cv2.imread, paths)):
+                if image is None:
+                    continue
+                if self._cache_size + image.nbytes > self.cache_bytes:
+                    break
+                self._cache_put(crop_path, image)
+        logger.info(f"Preloaded {len(self._cache)} of {len(paths)} crops ({self._cache_size / 1e6:.1f} MB)")
+
+    def cache_info(self) -> dict:
+        """Cache counters, to size cache_bytes."""
+        with self._cache_lock:
+            lookups = self.cache_hits + self.cache_misses
+            return {
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "evictions": self.cache_evictions,
+                "hit_rate": self.cache_hits / lookups if lookups else 0.0,
+                "entries": len(self._cache),
+                "bytes": self._cache_size,
+                "max_bytes": self.cache_bytes,
+                "atlas": self.atlas_path,
+            }
+
+    def get_random_crop(self):
+        for _ in range(MAX_READ_ATTEMPTS):
+            # Get random class
+            chosen_class = self.classes[self._class_table.draw(random.random(), random.random())]
+
+            # Get random crop
+            chosen_crop = random.choice(self.crops[chosen_class])
+
+            image = self.read_crop(chosen_crop)
+            if image is not None:
+                break
             logger.warning(f"Could not load image: {chosen_crop}")
-            return self.get_random_crop()
+        else:
+            raise RuntimeError(f"Could not load any crop from {self.path}")
 
         # Randomly choose 2 augmentations
-        augmentations = [self.partial_block_out, self.blur, self.saturation, self.brightness, self.contrast, self.random_erase_top_or_bottom, self.random_erase_left_or_right, self.random_erase_middle]
+        augmentations = self.augmentations()
         chosen_augmentations = random.sample(augmentations, 2)
         for augmentation in chosen_augmentations:
             image = augmentation(image)
         
         # Return crop
         return image, chosen_class
-    
-    def partial_block_out(self, image):
+
+    def get_random_crops(self, n: int, rng=None) -> list:
+        """
+        Batch version of get_random_crop driven by a NumPy generator.
+
+        The same seed gives the same crops and augmentations, independent of the
+        global random state.
+
+        Args:
+            n: number of crops
+            rng: np.random.Generator or seed, None for a fresh unseeded generator
+
+        Returns:
+            List of n (image, class) tuples
+        """
+        rng = np.random.default_rng(rng)
+        augmentations = self.augmentations()
+
+        chosen_classes = self._class_table.sample(rng, n)
+        chosen_files = rng.integers(self._class_sizes[chosen_classes])
+        chosen_augmentations = [rng.choice(len(augmentations), 2, replace=False) for _ in range(n)]
+
+        crops = []
+        for class_index, file_index, augmentation_indices in zip(chosen_classes.tolist(), chosen_files.tolist(), chosen_augmentations):
+            for _ in range(MAX_READ_ATTEMPTS):
+                chosen_class = self.classes[class_index]
+                chosen_crop = self.crops[chosen_class][file_index]
+                image = self.read_crop(chosen_crop)
+                if image is not None:
+                    break
+                logger.warning(f"Could not load image: {chosen_crop}")
+                class_index = int(self._class_table.sample(rng, 1)[0])
+                file_index = int(rng.integers(self._class_sizes[class_index]))
+            else:
+                raise RuntimeError(f"Could not load any crop from {self.path}")
+
+            for augmentation_index in augmentation_indices:
+                image = augmentations[augmentation_index](image, rng)
+            crops.append((image, chosen_class))
+        return crops
+
+    def augmentations(self) -> list:
+        return [self.partial_block_out, self.blur, self.saturation, self.brightness, self.contrast, self.random_erase_top_or_bottom, self.random_erase_left_or_right, self.random_erase_middle]
+
+    # Augmentations modify the image in place and return it. Randomness comes from
+    # rng when given, otherwise from the global random module.
+
+    def partial_block_out(self, image, rng=None):
         #  Randomly block out a part of the image
         # Get random x, y, width, height
         # make block out horzontal line rather than vertical
-        x = random.randint(0, image.shape[1])
-        y = random.randint(0, image.shape[0]//5)
-        width = random.randint(0, image.shape[1] - x)
-        height = random.randint(0, image.shape[0] - y)
+        x = _randint(rng, 0, image.shape[1])
+        y = _randint(rng, 0, image.shape[0]//5)
+        width = _randint(rng, 0, image.shape[1] - x)
+        height = _randint(rng, 0, image.shape[0] - y)
         image[y:y+height, x:x+width] = 0
         return image
     
-    def blur(self, image):
+    def blur(self, image, rng=None):
         # Blur the image
-        image = cv2.GaussianBlur(image, (5, 5), 0)
-        return image
+        return cv2.GaussianBlur(image, (5, 5), 0, dst=image)
 
-    def saturation(self, image):
+    def saturation(self, image, rng=None):
         # Saturate the image
-        image = cv2.convertScaleAbs(image, alpha=1.5, beta=0)
-        return image
+        return cv2.LUT(image, SCALE_LUT, dst=image)
     
-    def brightness(self, image):
+    def brightness(self, image, rng=None):
         # Brighten the image
-        image = cv2.convertScaleAbs(image, alpha=1.5, beta=0)
-        return image
+        return cv2.LUT(image, SCALE_LUT, dst=image)
     
-    def contrast(self, image):
+    def contrast(self, image, rng=None):
         # Contrast the image
-        image = cv2.convertScaleAbs(image, alpha=1.5, beta=0)
-        return image
+        return cv2.LUT(image, SCALE_LUT, dst=image)
     
-    def random_erase_top_or_bottom(self, image):
+    def random_erase_top_or_bottom(self, image, rng=None):
         # Randomly erase the top or bottom of the image
-        if random.random() < 0.5:
+        if _random(rng) < 0.5:
             image[:image.shape[0]//5, :] = 0
         else:
             image[image.shape[0]//5:, :] = 0
         return image
     
-    def random_erase_left_or_right(self, image):
+    def random_erase_left_or_right(self, image, rng=None):
         # Randomly erase the left or right of the image
-        if random.random() < 0.5:
+        if _random(rng) < 0.5:
             image[:, :image.shape[1]//5] = 0
         else:
             image[:, image.shape[1]//5:] = 0
         return image
     
-    def random_erase_middle(self, image):
+    def random_erase_middle(self, image, rng=None):
         # Randomly erase the middle of the image
         image[image.shape[0]//5*2:image.shape[0]//5*3, :] = 0
         return image
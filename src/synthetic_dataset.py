@@ -0,0 +1,299 @@
+import os
+import logging
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from ultralytics.data.dataset import YOLODataset as UltralyticsYOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer
+from ultralytics.utils import colorstr
+
+from .generator import YOLOv8Generator
+from .image_index import list_images
+
+"""
+
+On-the-fly synthetic training data
+
+Instead of stitching a fixed synthetic set to disk and training on it, every
+training sample is composed in the dataloader workers when it is requested:
+a random background, a few random parts pasted on with YOLOv8Generator.compose,
+labels taken from the placements. Nothing is written to disk and every epoch
+sees new samples.
+
+Use it through train_model(..., synthetic={...}) or by passing
+synthetic_trainer(...) as the trainer of model.train. Validation still runs on
+the real val split of the data YAML.
+
+"""
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class SyntheticYOLODataset(UltralyticsYOLODataset):
+    """
+    Ultralytics detection dataset whose samples are composed in memory on every access.
+
+    Samples are composed at training resolution: the background is scaled so its long
+    side is imgsz and the parts are scaled relative to it, so no full resolution image
+    is ever composed. Mosaic and the other Ultralytics augmentations run on top as usual.
+    """
+
+    def __init__(self, *args, backgrounds: str, parts: dict[int, str], length: int = 10000,
+                 parts_per_image: int = 3, part_scale: tuple[float, float] = (0.2, 0.6),
+                 overlap_ratio: float = 0.1, cache_size: int = 512, **kwargs):
+        """
+        Args:
+            backgrounds: folder of background images, searched recursively
+            parts: folder of part crops per class id, searched recursively. PNG crops with
+                   an alpha channel are blended along their edges
+            length: number of samples per epoch
+            parts_per_image: maximum number of parts per sample, each sample gets 1 to this many
+            part_scale: range of the long side of a part relative to the long side of the background
+            overlap_ratio: maximum share of a part that may cover parts placed before it
+            cache_size: decoded images kept per dataloader worker, least recently used are dropped
+            args, kwargs: passed to the Ultralytics YOLODataset, caching and rect are always off
+        """
+        self.background_paths = list_images(backgrounds)
+        self.part_paths = {class_id: list_images(folder) for class_id, folder in parts.items()}
+        self.part_paths = {class_id: paths for class_id, paths in self.part_paths.items() if paths}
+        if not self.background_paths:
+            raise ValueError(f"No background images found in {backgrounds}")
+        if not self.part_paths:
+            raise ValueError(f"No part images found in {parts}")
+
+        self.length = length
+        self.parts_per_image = parts_per_image
+        self.part_scale = part_scale
+        self.overlap_ratio = overlap_ratio
+        self.cache_size = cache_size
+        self.part_classes = sorted(self.part_paths)
+
+        # Ultralytics only applies classes to the stored labels, composed labels are filtered in get_image_and_label
+        self.include_class = kwargs.get("classes")
+
+        # Per process state, rebuilt in every dataloader worker (see _worker_state)
+        self._pid = None
+        self._rng = None
+        self._generator = None
+        self._images = OrderedDict()
+
+        # Composed samples cannot be cached or grouped by aspect ratio
+        kwargs["cache"] = False
+        kwargs["rect"] = False
+        super().__init__(*args, img_path=backgrounds, **kwargs)
+        logger.info(f"Synthetic dataset: {len(self.background_paths)} backgrounds, "
+                    f"{sum(len(paths) for paths in self.part_paths.values())} parts in "
+                    f"{len(self.part_paths)} classes, {length} samples per epoch")
+
+    def get_img_files(self, img_path):
+        # One virtual file per sample, Ultralytics only uses them for names and lengths
+        return [os.path.join(str(img_path), f"synthetic_{index}.jpg") for index in range(self.length)]
+
+    def get_labels(self):
+        # Placeholders, the real labels only exist once a sample is composed
+        height, width = (self.imgsz, self.imgsz) if isinstance(self.imgsz, int) else self.imgsz
+        return [
+            {
+                "im_file": im_file,
+                "shape": (height, width),
+                "cls": np.zeros((0, 1), dtype=np.float32),
+                "bboxes": np.zeros((0, 4), dtype=np.float32),
+                "segments": [],
+                "keypoints": None,
+                "normalized": True,
+                "bbox_format": "xywh",
+            }
+            for im_file in self.im_files
+        ]
+
+    def check_cache_ram(self, *args, **kwargs) -> bool:
+        return False
+
+    def check_cache_disk(self, *args, **kwargs) -> bool:
+        return False
+
+    def _worker_state(self):
+        """
+        Random state and file lists of this process.
+
+        Forked dataloader workers would otherwise all draw the same samples. The path
+        lists are copied as unreadable files are dropped from them per process.
+        """
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._rng = np.random.default_rng()
+            self._generator = YOLOv8Generator(self.overlap_ratio, seed=int(self._rng.integers(2 ** 63)))
+            self._images = OrderedDict()
+            self.background_paths = list(self.background_paths)
+            self.part_paths = {class_id: list(paths) for class_id, paths in self.part_paths.items()}
+        return self._rng, self._generator
+
+    def _read(self, path: str, flags: int, prepare=None) -> np.ndarray | None:
+        """Decoded (and prepared) image from the per worker LRU cache, callers must not modify it."""
+        image = self._images.get(path)
+        if image is not None:
+            self._images.move_to_end(path)
+            return image
+
+        image = cv2.imread(path, flags)
+        if image is None:
+            logger.warning(f"Could not load image: {path}")
+            return None
+        if prepare is not None:
+            image = prepare(image)
+        self._images[path] = image
+        while len(self._images) > self.cache_size:
+            self._images.popitem(last=False)
+        return image
+
+    def _resize_background(self, image: np.ndarray) -> np.ndarray:
+        # Long side to imgsz, like Ultralytics load_image does for files
+        imgsz = self.imgsz if isinstance(self.imgsz, int) else max(self.imgsz)
+        height, width = image.shape[:2]
+        scale = imgsz / max(height, width)
+        if scale == 1:
+            return image
+        return cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                          interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+
+    def _background(self, rng: np.random.Generator) -> np.ndarray:
+        # Cached at training size, so the cache holds imgsz sized backgrounds
+        for _ in range(10):
+            path = self.background_paths[int(rng.integers(len(self.background_paths)))]
+            image = self._read(path, cv2.IMREAD_COLOR, self._resize_background)
+            if image is not None:
+                return image
+            if len(self.background_paths) > 1:
+                self.background_paths.remove(path)
+        raise RuntimeError("Could not load any background image")
+
+    def _parts(self, rng: np.random.Generator, background_size: tuple[int, int]) -> tuple[list, list]:
+        background_height, background_width = background_size
+        parts, classes = [], []
+        for _ in range(int(rng.integers(1, self.parts_per_image + 1))):
+            class_id = self.part_classes[int(rng.integers(len(self.part_classes)))]
+            paths = self.part_paths[class_id]
+            if not paths:
+                continue
+            path = paths[int(rng.integers(len(paths)))]
+            part = self._read(path, cv2.IMREAD_UNCHANGED)
+            if part is None:
+                paths.remove(path)  # Only from this process's copy (see _worker_state), so it is not read again
+                continue
+            if part.ndim == 2:
+                part = cv2.cvtColor(part, cv2.COLOR_GRAY2BGR)
+
+            # Part long side relative to the background long side, never larger than the background
+            height, width = part.shape[:2]
+            scale = rng.uniform(*self.part_scale) * max(background_size) / max(height, width)
+            scale = min(scale, background_height / height, background_width / width)
+            size = (max(1, int(width * scale)), max(1, int(height * scale)))
+            parts.append(cv2.resize(part, size, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR))
+            classes.append(class_id)
+        return parts, classes
+
+    def compose(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Compose one random sample.
+
+        Returns:
+            BGR image, (n, 1) float32 class ids and (n, 4) float32 normalised xywh boxes
+        """
+        rng, generator = self._worker_state()
+        background = self._background(rng)
+        height, width = background.shape[:2]
+
+        parts, classes = self._parts(rng, (height, width))
+        if not parts:
+            return background, np.zeros((0, 1), dtype=np.float32), np.zeros((0, 4), dtype=np.float32)
+
+        image, positions = generator.compose(background, parts, classes, perimeter_end=(width, height))
+        boxes = np.array([[x1, y1, x2, y2] for (x1, y1), (x2, y2), _ in positions], dtype=np.float32).reshape(-1, 4)
+        cls = np.array([class_id for _, _, class_id in positions], dtype=np.float32).reshape(-1, 1)
+
+        xywh = np.empty_like(boxes)
+        xywh[:, 0] = (boxes[:, 0] + boxes[:, 2]) / 2 / width
+        xywh[:, 1] = (boxes[:, 1] + boxes[:, 3]) / 2 / height
+        xywh[:, 2] = (boxes[:, 2] - boxes[:, 0]) / width
+        xywh[:, 3] = (boxes[:, 3] - boxes[:, 1]) / height
+        return np.ascontiguousarray(image), cls, xywh
+
+    def get_image_and_label(self, index):
+        # Mosaic and MixUp call this directly for their extra samples, so they are fresh too
+        image, cls, bboxes = self.compose()
+
+        # Mosaic draws its extra indices from the buffer, which Ultralytics fills in load_image.
+        # Composed samples never go through it, so the index is recorded here the same way
+        if self.augment:
+            self.buffer.append(index)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                self.buffer.pop(0)
+
+        # Same order as Ultralytics update_labels: class filter first, then single_cls
+        if self.include_class:
+            keep = np.isin(cls[:, 0], self.include_class)
+            cls, bboxes = cls[keep], bboxes[keep]
+        if self.single_cls:
+            cls[:] = 0
+
+        shape = image.shape[:2]
+        label = {
+            "im_file": self.im_files[index],
+            "img": image,
+            "ori_shape": shape,
+            "resized_shape": shape,
+            "ratio_pad": (1.0, 1.0),
+            "cls": cls,
+            "bboxes": bboxes,
+            "segments": [],
+            "keypoints": None,
+            "normalized": True,
+            "bbox_format": "xywh",
+        }
+        return self.update_labels_info(label)
+
+
+class SyntheticDetectionTrainer(DetectionTrainer):
+    """
+    DetectionTrainer training on SyntheticYOLODataset, validating on the real val split.
+
+    Configured through the synthetic class attribute (the keyword arguments of
+    SyntheticYOLODataset), as Ultralytics creates the trainer itself. Use
+    synthetic_trainer to get a configured subclass.
+    """
+
+    synthetic: dict = {}
+
+    def build_dataset(self, img_path, mode="train", batch=None):
+        if mode != "train":
+            return super().build_dataset(img_path, mode, batch)
+        stride = max(int(self.model.stride.max()) if self.model else 0, 32)
+        return SyntheticYOLODataset(
+            imgsz=self.args.imgsz,
+            batch_size=batch,
+            augment=True,
+            hyp=self.args,
+            single_cls=self.args.single_cls or False,
+            stride=stride,
+            pad=0.0,
+            prefix=colorstr("train: "),
+            classes=self.args.classes,
+            data=self.data,
+            **self.synthetic,
+        )
+
+    def plot_training_labels(self):
+        # Labels only exist once samples are composed
+        pass
+
+
+def synthetic_trainer(**synthetic) -> type:
+    """
+    SyntheticDetectionTrainer subclass configured with the SyntheticYOLODataset keyword arguments.
+
+    Pass it as model.train(trainer=...). Single process only, multi GPU training
+    re-imports the trainer class by name and would lose the configuration.
+    """
+    return type("SyntheticDetectionTrainer", (SyntheticDetectionTrainer,), {"synthetic": synthetic})
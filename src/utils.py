@@ -3,6 +3,23 @@ import shutil
 import random
 from pathlib import Path
 
+def remove_if_exists(path: str) -> None:
+    """Remove a file before it is rewritten, it may be a hardlink to a source file."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def link_or_copy(src: str, dst: str) -> None:
+    """Hardlink src to dst, falling back to a copy across filesystems."""
+    remove_if_exists(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
 def copy_random_half_files(source_dir, destination_dir, ratio=0.5):
     """
     Copies a random half of the files from source_dir to destination_dir.
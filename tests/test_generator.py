@@ -0,0 +1,25 @@
+import numpy as np
+
+from src.generator import PlacementGrid
+
+
+def _overlap(a, b):
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    return max(0, width) * max(0, height)
+
+
+def test_big_part_does_not_hide_small_part():
+    max_overlap = 0.05
+    for seed in range(500):
+        grid = PlacementGrid((200, 200), max_overlap, (0, 0), (200, 200), np.random.default_rng(seed))
+        boxes = []
+        for width, height in ((10, 10), (100, 100)):
+            position = grid.sample((height, width))
+            assert position is not None
+            x, y = position
+            grid.occupy((x, y), (x + width, y + height))
+            boxes.append((x, y, x + width, y + height))
+
+        small, big = boxes
+        assert _overlap(small, big) <= max_overlap * 10 * 10
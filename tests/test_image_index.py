@@ -0,0 +1,13 @@
+import numpy as np
+
+from src.image_index import PNG_SIGNATURE, read_image_size, read_image_sizes
+
+
+def test_truncated_png_is_unreadable(tmp_path):
+    # Signature and IHDR tag, but the header ends before the image size
+    truncated = tmp_path / "truncated.png"
+    truncated.write_bytes(PNG_SIGNATURE + b"\x00\x00\x00\x0dIHDR\x00\x00")
+    assert read_image_size(str(truncated)) is None
+
+    sizes = read_image_sizes([str(truncated), str(tmp_path / "missing.png")])
+    np.testing.assert_array_equal(sizes, [[-1, -1], [-1, -1]])